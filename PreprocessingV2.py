@@ -1,49 +1,353 @@
-import trimesh
 import numpy as np
-import matplotlib.pyplot as plt
+import argparse
+import contextlib
+import cProfile
+import hashlib
+import importlib.util
+import io
+import json
+import mmap
 import os
+import posixpath
 import shutil
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Import a module on first attribute access instead of now. trimesh takes most of a second to
+# import and the app only needs it once a conversion starts. Check the startup cost with
+# python benchmark.py startup
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+trimesh = lazy_import("trimesh")
+
+# Raised from a progress callback to stop a conversion between views
+class ScanCancelled(Exception):
+    pass
+
 
 def clear_file(filename):
     # Open the file in write mode to clear its contents
     with open(filename, 'w') as file:
         pass  # Opening in 'w' mode clears the file, so no need to write anything
 
-def scan_obj(obj_file):
-    mesh = trimesh.load(obj_file)
-    # Get the bounding box min and max values
-    min_val, max_val = mesh.bounds[0], mesh.bounds[1]
-    #print(f"Bounding Box Min: {min_val}, Max: {max_val}")
-
-    min_val = min_val
-    max_val = max_val
-
-    # Find the maximum range across all dimensions (X, Y, Z)
-    max_range = max(max_val - min_val)  # This gives the largest span (X, Y, or Z)
-    center = (min_val + max_val) / 2.0
-    quadrants = get_quadrants(center=center,max_range=max_range)
-
-    output_dir = 'output_folder'
+# Persistent cache of finished conversions, keyed on mesh content and scan parameters
+CACHE_FOLDER = "scan_cache"
+CACHE_SIZE = 256 * 1024 * 1024  # bytes kept before the least recently used caves are evicted
+CACHE_VERSION = 1  # bump when the output format changes so stale entries are never reused
+CACHE_TEMP_AGE = 60 * 60  # seconds before an unfinished store is taken to be left by a crashed run
+
+# grid_size is the number of LEDs across a row (both arms) and the number of rows, num_rotations
+# the number of angular slices. progress, if given, is called as
+# progress(views_done, view_count, label) after each view is written. simplify scans a reduced
+# copy of the mesh (see MESH SIMPLIFICATION). report, if given, collects per stage timings
+# (see INSTRUMENTATION)
+def scan_obj(obj_file, backend="ray", voxel_resolution=128, batched=True, workers=None, output_dir="output_folder",
+             cache_dir=CACHE_FOLDER, cache_size=CACHE_SIZE, progress=None, grid_size=16, num_rotations=55,
+             simplify=False, report=None):
+    if grid_size < 2 or grid_size % 2:
+        raise ValueError(f"grid_size must be an even number of at least 2, got {grid_size}")
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     clear_folder(output_dir)
-    # Generate the base grid
-    base_grid = generate_base_grid(cube_size=16, center=center,max_range=max_range)
 
+    # Converting the same mesh with the same parameters again is just a copy out of the cache
+    if cache_dir is not None:
+        with measure_stage(report, "cache_lookup"):
+            cache_key = get_cache_key(obj_file, backend=backend, voxel_resolution=voxel_resolution,
+                                      grid_size=grid_size, num_rotations=num_rotations, simplify=simplify)
+            cached = restore_from_cache(cache_key, output_dir, cache_dir)
+        if cached:
+            if progress is not None:
+                view_count = len(get_view_labels())
+                progress(view_count, view_count, "cached")
+            return output_dir
+
+    with measure_stage(report, "load"):
+        if simplify:
+            mesh, (min_val, max_val) = load_simplified_mesh(obj_file, grid_size=grid_size)
+        else:
+            mesh = trimesh.load(obj_file)
+            # Get the bounding box min and max values
+            min_val, max_val = mesh.bounds[0], mesh.bounds[1]
+    #print(f"Bounding Box Min: {min_val}, Max: {max_val}")
+
+    with measure_stage(report, "grid"):
+        # Find the maximum range across all dimensions (X, Y, Z)
+        max_range = max(max_val - min_val)  # This gives the largest span (X, Y, or Z)
+        center = (min_val + max_val) / 2.0
+        quadrants = get_quadrants(center=center,max_range=max_range)
+
+        # Generate the base grid
+        base_grid = generate_base_grid(cube_size=grid_size, num_rotations=num_rotations, center=center,max_range=max_range)
+        # The quadrant grid is the base grid scaled down, so both share one index table
+        polar_index = get_polar_index(grid_size=grid_size, num_rotations=num_rotations)
+        views = get_scan_views(base_grid, center, quadrants)
+
+    if workers is not None and workers > 1:
+        perform_parallel_scan(mesh, views, polar_index, workers, backend=backend, resolution=voxel_resolution,
+                              output_folder=output_dir, progress=progress, report=report)
+    else:
+        with measure_stage(report, "containment_setup"):
+            contains = get_containment(mesh, backend=backend, resolution=voxel_resolution)
+        if batched:
+            perform_batched_scan(contains, views, polar_index, output_folder=output_dir, progress=progress,
+                                 report=report)
+        else:
+            for views_done, (label, (grid, location)) in enumerate(views.items(), start=1):
+                perform_scan(mesh, grid, location, label=label, polar_index=polar_index, contains=contains,
+                             output_folder=output_dir, report=report)
+                if progress is not None:
+                    progress(views_done, len(views), label)
+
+    if cache_dir is not None:
+        with measure_stage(report, "cache_store"):
+            try:
+                store_in_cache(cache_key, output_dir, cache_dir, cache_size)
+            except OSError as e:
+                print(f"Could not store the conversion of {obj_file} in {cache_dir}: {e}")  # The views are written
+    return output_dir
 
-    location = (center[0], center[1], center[2])  # Use the center of the object
-    inside_points, outside_points = perform_scan(mesh, base_grid, location, label="full_obj")
 
-    quadrant_points = []
+# Cache key: SHA-256 of the OBJ file contents plus every parameter that changes the output
+def get_cache_key(obj_file, backend="ray", voxel_resolution=128, grid_size=16, num_rotations=55, margin=0.1,
+                  simplify=False):
+    digest = hash_file(obj_file)
+    parameters = {
+        "version": CACHE_VERSION,
+        "grid_size": grid_size,
+        "num_rotations": num_rotations,
+        "margin": margin,
+        "backend": backend,
+        "voxel_resolution": voxel_resolution if backend == "voxel" else None,
+        # Quadrant offsets for a unit cave, so a change to the layout misses the cache
+        "quadrants": {label: list(offset) for label, offset in get_quadrants(center=(0, 0, 0), max_range=1).items()},
+        "quadrant_scale": 0.5,
+        "simplify": [SIMPLIFY_VERSION, SIMPLIFY_OVERSAMPLE] if simplify else None,
+    }
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+# Copy a cached conversion into output_dir. Returns False on a cache miss
+def restore_from_cache(cache_key, output_dir, cache_dir=CACHE_FOLDER):
+    entry = os.path.join(cache_dir, cache_key)
+    if not os.path.isdir(entry):
+        return False
+
+    for file_name in os.listdir(entry):
+        shutil.copy(os.path.join(entry, file_name), os.path.join(output_dir, file_name))
+    os.utime(entry)  # Mark as recently used for eviction
+    return True
+
+
+# Save a finished conversion under its key, then trim the cache back to cache_size bytes
+def store_in_cache(cache_key, output_dir, cache_dir=CACHE_FOLDER, cache_size=CACHE_SIZE):
+    entry = os.path.join(cache_dir, cache_key)
+    if os.path.isdir(entry):
+        os.utime(entry)
+        return
+
+    # Fill a private folder first and rename it into place, so a half-copied entry is never used
+    temp_entry = f"{entry}.{os.getpid()}.tmp"
+    if os.path.exists(temp_entry):
+        shutil.rmtree(temp_entry)  # Left by a crashed run that had the same pid
+    shutil.copytree(output_dir, temp_entry)
+    try:
+        os.rename(temp_entry, entry)
+    except OSError:
+        shutil.rmtree(temp_entry, ignore_errors=True)  # Another process stored it first
+    evict_cache(cache_dir, cache_size)
+
+
+# Remove the least recently used entries until the cache fits in cache_size bytes, and unfinished
+# stores older than CACHE_TEMP_AGE
+def evict_cache(cache_dir=CACHE_FOLDER, cache_size=CACHE_SIZE):
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if not os.path.isdir(entry):
+            continue
+        if name.endswith(".tmp"):
+            if time.time() - os.path.getmtime(entry) > CACHE_TEMP_AGE:
+                shutil.rmtree(entry, ignore_errors=True)
+            continue
+        size = sum(os.path.getsize(os.path.join(entry, file_name)) for file_name in os.listdir(entry))
+        entries.append((os.path.getmtime(entry), size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= cache_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+# Sampling grid and location of every view: the full grid at the center of the object,
+# then the grid scaled down for each quadrant
+def get_scan_views(base_grid, center, quadrants):
+    views = {"full_obj": (base_grid, (center[0], center[1], center[2]))}
+    scaled_grid = base_grid * 0.5  # Scale down the grid for quadrants
     for quadrant_label, location in quadrants.items():
-        scaled_grid = base_grid * 0.5  # Scale down the grid for quadrants
-        inside_q, outside_q = perform_scan(mesh, scaled_grid, location, label=quadrant_label)
-        quadrant_points.append((inside_q, outside_q))
-    return output_dir
+        views[quadrant_label] = (scaled_grid, location)
+    return views
+
+
+# Ray-cast backend: trimesh casts a ray for every point on every scan. Without embree the
+# intersector materialises every ray/triangle candidate at once, so large batches are split
+# into chunks about the size of one view to keep memory bounded
+def ray_containment(mesh, resolution=None, chunk_size=16384):
+    if trimesh.ray.has_embree:
+        return mesh.contains
+
+    def contains(points):
+        points = np.asarray(points, dtype=np.float64)
+        if len(points) <= chunk_size:
+            return mesh.contains(points)
+        return np.concatenate([mesh.contains(points[start:start + chunk_size])
+                               for start in range(0, len(points), chunk_size)])
+    return contains
+
+
+# Voxel backend: voxelize and fill the mesh once, then every scan is an indexed lookup
+# into the occupancy volume. resolution is the number of voxels across the largest extent
+def voxel_containment(mesh, resolution=128):
+    occupancy = mesh.voxelized(pitch=max(mesh.extents) / resolution).fill()
+    return occupancy.is_filled
+
+
+# trimesh.ray.ray_util.contains_points casts its parity rays both ways along this direction
+RAY_TEST_DIRECTION = np.array([0.4395064455, 0.617598629942, 0.652231566745])
+
+# Culled ray backend: the same two-way parity test as mesh.contains, but each tile of the
+# sampling points is only tested against the triangles whose projection along the ray
+# direction overlaps that tile. No other triangle can be hit by those rays, so the hit counts
+# match the full mesh exactly. Points whose two rays disagree are sent to the full
+# mesh.contains, which retries them in another direction
+def culled_ray_containment(mesh, resolution=None, tiles=4, margin=1e-3, chunk_size=16384):
+    # Orthonormal basis of the plane perpendicular to the ray direction
+    direction = RAY_TEST_DIRECTION / np.linalg.norm(RAY_TEST_DIRECTION)
+    u = np.cross(direction, [1.0, 0.0, 0.0])
+    u /= np.linalg.norm(u)
+    basis = np.array([u, np.cross(direction, u)])
+
+    # Projected bounds of every triangle, worked out once per mesh
+    projected = mesh.triangles @ basis.T
+    face_min = projected.min(axis=1)
+    face_max = projected.max(axis=1)
+    margin = margin * mesh.scale
+
+    def contains(points):
+        points = np.asarray(points, dtype=np.float64)
+        result = np.zeros(len(points), dtype=bool)
+        # Points outside the bounding box are never inside, exactly as trimesh does
+        candidates = np.nonzero(trimesh.bounds.contains(mesh.bounds, points))[0]
+        if len(candidates) == 0:
+            return result
+
+        uv = points[candidates] @ basis.T
+        lower, upper = uv.min(axis=0), uv.max(axis=0)
+        tile_size = np.maximum((upper - lower) / tiles, 1e-12)
+        tile_uv = np.minimum(((uv - lower) // tile_size).astype(np.int64), tiles - 1)
+        tile_id = tile_uv[:, 0] * tiles + tile_uv[:, 1]
+
+        broken = []
+        for tile in np.unique(tile_id):
+            in_tile = candidates[tile_id == tile]
+            tile_points = points[in_tile]
+            tile_lower = uv[tile_id == tile].min(axis=0) - margin
+            tile_upper = uv[tile_id == tile].max(axis=0) + margin
+            faces = np.nonzero(np.all(face_max >= tile_lower, axis=1) & np.all(face_min <= tile_upper, axis=1))[0]
+            if len(faces) == 0:
+                continue
+            submesh = mesh if len(faces) == len(mesh.faces) else mesh.submesh([faces], append=True)
+
+            for start in range(0, len(in_tile), chunk_size):
+                chunk = in_tile[start:start + chunk_size]
+                chunk_points = tile_points[start:start + chunk_size]
+                ray_directions = np.tile(RAY_TEST_DIRECTION, (len(chunk), 1))
+                _location, index_ray, _c = submesh.ray.intersects_location(
+                    np.vstack((chunk_points, chunk_points)),
+                    np.vstack((ray_directions, -ray_directions)),
+                    multiple_hits=True)
+                hits = np.bincount(index_ray, minlength=2 * len(chunk)).reshape((2, -1))
+                odd = hits % 2 == 1
+                agree = odd[0] == odd[1]
+                result[chunk] = odd[0] & agree
+                broken.append(chunk[~agree & (hits != 0).all(axis=0)])
+
+        broken = np.concatenate(broken) if broken else np.zeros(0, dtype=np.int64)
+        if len(broken) > 0:
+            result[broken] = mesh.contains(points[broken])
+        return result
+    return contains
+
+
+CONTAINMENT_BACKENDS = {
+    "ray": ray_containment,
+    "culled": culled_ray_containment,
+    "voxel": voxel_containment,
+}
+
+# Build the points -> inside/outside function for the named containment backend
+def get_containment(mesh, backend="ray", resolution=128):
+    if backend not in CONTAINMENT_BACKENDS:
+        raise ValueError(f"Unknown containment backend {backend!r}, expected one of {sorted(CONTAINMENT_BACKENDS)}")
+    return CONTAINMENT_BACKENDS[backend](mesh, resolution=resolution)
+
+
+# Accuracy report: how many grid points a backend classifies differently from ray casting,
+# for the full view and every quadrant of the given OBJ file at the given scan resolution
+def compare_containment(obj_file, backend="voxel", voxel_resolution=128, grid_size=16, num_rotations=55):
+    mesh = trimesh.load(obj_file)
+    reference = get_containment(mesh, backend="ray")
+    candidate = get_containment(mesh, backend=backend, resolution=voxel_resolution)
+
+    min_val, max_val = mesh.bounds[0], mesh.bounds[1]
+    max_range = max(max_val - min_val)
+    center = (min_val + max_val) / 2.0
+    base_grid = generate_base_grid(cube_size=grid_size, num_rotations=num_rotations, center=center, max_range=max_range)
+    views = get_scan_views(base_grid, center, get_quadrants(center=center, max_range=max_range))
+
+    report = {}
+    for label, (grid, location) in views.items():
+        points = grid + np.asarray(location)
+        report[label] = int(np.count_nonzero(reference(points) != candidate(points)))
+
+    total = len(base_grid) * len(views)
+    disagree = sum(report.values())
+    worst = max(report, key=report.get)
+    print(f"{os.path.basename(obj_file)}: {backend} disagrees with ray on {disagree} of {total} points "
+          f"({100 * disagree / total:.2f}%), most in {worst} ({report[worst]} of {len(base_grid)})")
+    return report
 
 # Function to generate the base grid with rotation around the YZ-plane (x=0, y=0)
 def generate_base_grid(cube_size, num_rotations=55, center=[0,0,0], max_range=0, margin=0.1):
-    grid_size = 16
+    grid_size = cube_size
     y_range = np.linspace(0 - max_range / 2 - margin, 0 + max_range / 2 + margin, grid_size)
     z_range = np.linspace(0 - max_range / 2 - margin, 0 + max_range / 2 + margin, grid_size)
     z, y = np.meshgrid(z_range, y_range)
@@ -70,150 +374,262 @@ def generate_base_grid(cube_size, num_rotations=55, center=[0,0,0], max_range=0,
     # Combine all rotated points into a single 3D grid
     return np.vstack(all_rotated_points)
 
-# Function to perform the scan
-def perform_scan(mesh, scaled_grid, location, label):
-    x_center, y_center, z_center = location
 
-    # Adjust the grid based on the location
-    adjusted_grid = []
-    for point in scaled_grid:
-        adjusted_grid.append([point[0]+x_center,point[1]+y_center,point[2]+z_center])
-
-    # Use mesh.contains to check if points are inside the mesh
-    is_inside = mesh.contains(adjusted_grid)
-    index = 0
-    inside_points = []
-    outside_points = []
-    for x in is_inside:
-        if x == True:
-            inside_points.append(adjusted_grid[index])
-        else:
-            outside_points.append(adjusted_grid[index])
-        index+=1
+PolarIndex = namedtuple("PolarIndex", ["grid_size", "angles", "angle_slot", "height_row", "bit"])
+
+# Map every point of the rotated base grid to the LED it drives: its angle slot, its height
+# row and its bit within that row. The layout only depends on the grid size and the number
+# of rotations (not on max_range or margin), so it is worked out once from the grid indices
+# and reused by the full scan and every quadrant. A row is two arms of grid_size / 2 LEDs, so
+# grid_size has to be even
+@lru_cache(maxsize=8)
+def get_polar_index(grid_size=16, num_rotations=55):
+    if grid_size < 2 or grid_size % 2:
+        raise ValueError(f"grid_size must be an even number of at least 2, got {grid_size}")
+    half = grid_size // 2
+    rotation, y_index, z_index = np.indices((num_rotations, grid_size, grid_size)).reshape(3, -1)
+
+    # Angles are counted in steps of 90 / num_rotations degrees so they compare exactly.
+    # Rotation i turns the +y half of the square to i * 360 / num_rotations + 90 degrees
+    # and the -y half to the opposite side
+    full_turn = 4 * num_rotations
+    angle_code = (4 * rotation + np.where(y_index >= half, 1, 3) * num_rotations) % full_turn
+
+    # Each slot is an angle a in the first half turn (0, 180]; points at a light the upper
+    # half of the row and points at a + 180 light the lower half
+    front_key = (angle_code - 1) % full_turn + 1
+    back_key = (angle_code + full_turn // 2 - 1) % full_turn + 1
+    slot_keys = np.unique(front_key)
+    slot_keys = slot_keys[:len(slot_keys) // 2]
+    front_slot = index_of(slot_keys, front_key)
+    back_slot = index_of(slot_keys, back_key)
+    is_front = front_slot >= 0
+    angle_slot = np.where(is_front, front_slot, back_slot)
+
+    # Radius index counts outwards from the rotation axis on either side of the square
+    distance_index = np.where(y_index >= half, y_index - half, half - 1 - y_index)
+    bit = np.where(is_front, distance_index + half, half - 1 - distance_index)
+    height_row = grid_size - 1 - z_index
+
+    for array in (angle_slot, height_row, bit):
+        array.setflags(write=False)
+    angles = tuple(round(int(key) * 90 / num_rotations, 3) for key in slot_keys)
+    return PolarIndex(grid_size, angles, angle_slot, height_row, bit)
+
+
+# Turn the inside/outside result of a scan into its LED bit volume, indexed by
+# [angle slot, height row, bit], where bit 0 is the last character of a row
+def encode_scan_bits(is_inside, polar_index):
+    is_inside = np.asarray(is_inside, dtype=bool) & (polar_index.angle_slot >= 0)
+    bits = np.zeros((len(polar_index.angles), polar_index.grid_size, polar_index.grid_size), dtype=bool)
+    bits[polar_index.angle_slot[is_inside], polar_index.height_row[is_inside], polar_index.bit[is_inside]] = True
+    return bits
 
+# Function to perform the scan
+def perform_scan(mesh, scaled_grid, location, label, polar_index=None, contains=None, output_folder="output_folder",
+                 report=None):
+    # Adjust the grid based on the location
+    location = np.asarray(location, dtype=np.float64)
+    adjusted_grid = np.asarray(scaled_grid, dtype=np.float64) + location
+
+    # Use mesh.contains (or the chosen containment backend) to check if points are inside the mesh
+    if contains is None:
+        contains = mesh.contains
+    with measure_stage(report, f"contains:{label}"):
+        is_inside = np.asarray(contains(adjusted_grid), dtype=bool)
+    record_view(report, label, is_inside)
+    inside_points = adjusted_grid[is_inside]
+    outside_points = adjusted_grid[~is_inside]
+
+    # The grid layout is known, so encode straight from the inside/outside result
+    if polar_index is not None:
+        with measure_stage(report, f"encode:{label}"):
+            bits = encode_scan_bits(is_inside, polar_index)
+        with measure_stage(report, f"write:{label}"):
+            write_scan_bits(polar_index.angles, bits, output_folder=output_folder, label=label)
+    else:
+        with measure_stage(report, f"write:{label}"):
+            save_scan_output_to_file(adjusted_grid - location, inside_points - location,
+                                     output_folder=output_folder, label=label)
 
-    # Combine all points in one array
-    all_points = adjusted_grid
-
-    new_all_points = []
-    for point in all_points:
-        new_all_points.append([point[0]-x_center,point[1]-y_center,point[2]-z_center])
-    new_inside_points = []
-    for point in inside_points:
-        new_inside_points.append([point[0]-x_center,point[1]-y_center,point[2]-z_center])
+    return inside_points, outside_points
 
-    save_scan_output_to_file(new_all_points, new_inside_points, label=label)
 
-    return inside_points, outside_points
+# Batched scan: stack the translated grids of every view into one contiguous array, run a
+# single containment query over all of them and split the result back per view for encoding
+def perform_batched_scan(contains, views, polar_index, output_folder="output_folder", progress=None, report=None):
+    grids = [np.asarray(grid, dtype=np.float64) + np.asarray(location, dtype=np.float64)
+             for grid, location in views.values()]
+    points = np.ascontiguousarray(np.concatenate(grids))
+    with measure_stage(report, "contains:all"):
+        is_inside = np.asarray(contains(points), dtype=bool)
+
+    results = {}
+    offsets = np.cumsum([len(grid) for grid in grids])[:-1]
+    for label, view_inside in zip(views, np.split(is_inside, offsets)):
+        write_view(view_inside, polar_index, output_folder, label, report)
+        results[label] = view_inside
+        if progress is not None:
+            progress(len(results), len(views), label)
+    return results
+
+
+# Encode and write one view from its inside/outside result
+def write_view(is_inside, polar_index, output_folder, label, report=None):
+    record_view(report, label, is_inside)
+    with measure_stage(report, f"encode:{label}"):
+        bits = encode_scan_bits(is_inside, polar_index)
+    with measure_stage(report, f"write:{label}"):
+        write_scan_bits(polar_index.angles, bits, output_folder=output_folder, label=label)
+
+
+# Containment function of the current pool worker, built once per process by _init_scan_worker
+_worker_contains = None
+
+def _init_scan_worker(vertices, faces, backend, resolution):
+    global _worker_contains
+    mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+    _worker_contains = get_containment(mesh, backend=backend, resolution=resolution)
+
+
+def _contains_in_worker(points):
+    return np.asarray(_worker_contains(points), dtype=bool)
+
+
+# Parallel scan: every view is tested in a process pool. The mesh is sent to each worker once
+# as vertex/face arrays when the worker starts, not with every view, and the results are
+# encoded and written in view order by the parent so the output matches a serial run
+def perform_parallel_scan(mesh, views, polar_index, workers, backend="ray", resolution=128, output_folder="output_folder",
+                          progress=None, report=None):
+    grids = [np.asarray(grid, dtype=np.float64) + np.asarray(location, dtype=np.float64)
+             for grid, location in views.values()]
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_scan_worker,
+                             initargs=(mesh.vertices, mesh.faces, backend, resolution)) as executor:
+        results_in_order = executor.map(_contains_in_worker, grids)
+        for label in views:
+            # Time spent waiting on the pool for this view, the containment runs in the workers
+            with measure_stage(report, f"contains:{label}"):
+                view_inside = next(results_in_order)
+            write_view(view_inside, polar_index, output_folder, label, report)
+            results[label] = view_inside
+            if progress is not None:
+                progress(len(results), len(views), label)
+    return results
 
 # Function to write scan output to a text file
 def save_scan_output_to_file(all_points, inside_points, output_folder="output_folder", label="error"):
-    # Generate the filename based on the label
-    filename = os.path.join(output_folder, f"{label}_output.txt")
+    all_points = np.asarray(all_points, dtype=np.float64).reshape(-1, 3)
+    inside_points = np.asarray(inside_points, dtype=np.float64).reshape(-1, 3)
 
-    all_coords = []
-    for point in all_points:
-        x, y, z = point
-        r = np.sqrt(x ** 2 + y ** 2)  # Radial distance
-        theta = round((np.degrees(np.arctan2(y, x))), 3)  # Angle in degrees
-        all_coords.append(((float(r)), theta, z,x,y,z))
-
-    temp_list = []
-    for x in all_coords:
-        temp_list.append(x[3:])
+    # Polar coordinates of every grid point
+    x, y, z = all_points.T
+    all_r = np.sqrt(x ** 2 + y ** 2)  # Radial distance
+    all_theta = np.round(np.degrees(np.arctan2(y, x)), 3)  # Angle in degrees
 
     # Unique sorted lists for distances, angles, and heights
-    distance_list = sorted(set(x[0] for x in all_coords))
-    distance_list = remove_near_duplicates(distance_list)
-    angle_list = sorted(set(x[1] for x in all_coords))
-    height_list = list(sorted(set(x[2] for x in all_coords)))
-
-    #print(len(distance_list),len(angle_list),len(height_list))
-    #print(distance_list)
-    #print(angle_list)
-    #print(height_list)
-
-    inside_coords = []
-    for point in inside_points:
-        x, y, z = point
-        r = np.sqrt(x ** 2 + y ** 2)  # Radial distance
-        theta = round((np.degrees(np.arctan2(y, x))) % 360, 3)  # Angle in degrees
-        inside_coords.append(((float(r)), theta, z,x,y,z))
-    inside_coords = list(sorted(set(inside_coords)))
-    reversed_height_list = height_list[::-1]
-
-
-    temp_distance_list = []
-    for x in distance_list:
-        temp_distance_list.append(round(float(x), 5))
-    distance_list = temp_distance_list
-
-    temp_angle_list = []
-    for x in angle_list:
-        temp_angle_list.append(round((float(x)+180),3))
-    angle_list = temp_angle_list
-
-    temp_height_list = []
-    for x in height_list:
-        temp_height_list.append(round(float(x), 3))
-    height_list = temp_height_list
-
-
-    #print(distance_list)
-    #print(angle_list)
-    #print(height_list)
-
-
-
-    temp_inside_coords = []
-    for c in inside_coords:
-        temp_inside_coords.append((round(c[0],5),float(c[1]),round(float(c[2]),3),c[3],c[4],c[5]))
-    inside_coords = temp_inside_coords
-
-    #print(f'len of inside_coords = {len(inside_coords)}')
-    #print(f'len of all_coords = {len(all_coords)}')
-    #print(f'len of angle list = {len(angle_list)}')
-
-    everyother_angle_list = []
-    index = 0
-    for i in angle_list:
-        if index % 2 == 0:
-            everyother_angle_list.append(i)
-        index += 1
-
-    temp_index = 0
-    for a in angle_list[:int(len(angle_list)/2)]:
-        temp_list = []
-        for c in inside_coords:
-            if (c[1] == a) or (c[1] == round(a - 180,3)) or (c[1] == round(a + 180, 3)):
-                temp_list.append(c)
-                temp_index +=1
-            temp2_list = []
-            for y in temp_list:
-                temp2_list.append(y[3:])
-        #plot_3d_points(temp2_list)
-
-        with open(filename, 'a') as file:
-            file.write(f"{a}\n")
-
-        for h in reversed_height_list:
-            to_write = 0
-            h = round(h,3)
-            for y in temp_list:
-                if y[2] == h:
-                    if y[1] == a:
-                        distance_index = distance_list.index(y[0])
-                        to_write |= 1 << distance_index+8
-                    else:
-                        distance_index = distance_list.index(y[0])
-                        to_write |= 1 << 7-distance_index
-            with open(filename, 'a') as file:
-                file.write(f"{bin(to_write)[2:].zfill(16)}\n")
+    distance_list = remove_near_duplicates(np.unique(all_r).tolist())
+    distance_list = np.array([round(d, 5) for d in distance_list])
+    angle_list = [round(float(a) + 180, 3) for a in np.unique(all_theta)]
+    reversed_height_list = np.round(np.unique(z)[::-1], 3)
+
+    # Polar coordinates of the inside points, rounded the same way the rows are matched
+    x, y, z = inside_points.T
+    inside_r = python_round(np.sqrt(x ** 2 + y ** 2), 5)
+    inside_theta = np.round(np.degrees(np.arctan2(y, x)) % 360, 3)
+    inside_height = python_round(z, 3)
+
+    # Each row covers a full diameter: points at angle a light the upper half of the row,
+    # points on the opposite side (a +/- 180) light the lower half
+    half = len(distance_list)
+    half_angle_list = angle_list[:len(angle_list) // 2]
+    front_slot, front_point = match_pairs(np.array(half_angle_list), inside_theta)
+    low_slot, low_point = match_pairs(np.array([round(a - 180, 3) for a in half_angle_list]), inside_theta)
+    high_slot, high_point = match_pairs(np.array([round(a + 180, 3) for a in half_angle_list]), inside_theta)
+
+    point_count = max(len(inside_points), 1)
+    front_pairs = front_slot * point_count + front_point
+    pairs = np.unique(np.concatenate([front_pairs,
+                                      low_slot * point_count + low_point,
+                                      high_slot * point_count + high_point]))
+    angle_index, point_index = np.divmod(pairs, point_count)
+
+    # Bin every matched point into its height row and radius bit
+    row_heights, row_index = np.unique(reversed_height_list, return_inverse=True)
+    height_index = index_of(row_heights, inside_height)[point_index]
+    in_row = height_index >= 0
+    angle_index, point_index, height_index = angle_index[in_row], point_index[in_row], height_index[in_row]
+    point_distance = index_of(distance_list, inside_r)[point_index]
+    if np.any(point_distance < 0):
+        raise ValueError(f"{inside_r[point_index[point_distance < 0][0]]} is not in distance list")
+    bit = np.where(np.isin(pairs[in_row], front_pairs), point_distance + half, half - 1 - point_distance)
+
+    bits = np.zeros((len(half_angle_list), len(row_heights), 2 * half), dtype=bool)
+    bits[angle_index, height_index, bit] = True
+    write_scan_bits(half_angle_list, bits[:, row_index], output_folder=output_folder, label=label)
 
     #if len(inside_points) > 1:
         #plot_3d_points(inside_points)
 
 
+# Every (candidate index, value index) pair where candidates[i] == values[j], in linear-log time
+def match_pairs(candidates, values):
+    order = np.argsort(candidates, kind="stable")
+    sorted_candidates = candidates[order]
+    start = np.searchsorted(sorted_candidates, values, side="left")
+    counts = np.searchsorted(sorted_candidates, values, side="right") - start
+
+    value_index = np.repeat(np.arange(len(values)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return order[np.repeat(start, counts) + within], value_index
+
+
+# Write one angle header followed by its height rows for every angle slot. bits is indexed by
+# [angle slot, height row, bit] and each row is written most significant bit first
+def write_scan_bits(angles, bits, output_folder="output_folder", label="error"):
+    filename = os.path.join(output_folder, f"{label}_output.txt")
+    write_file_atomic(filename, format_scan_bits(angles, bits))
+
+
+# Render a bit volume as the text view format, building the row characters with array ops
+def format_scan_bits(angles, bits):
+    bits = np.asarray(bits, dtype=bool)
+    characters = np.where(bits[:, :, ::-1], ord("1"), ord("0")).astype(np.uint8)
+    newlines = np.full(characters.shape[:2] + (1,), ord("\n"), dtype=np.uint8)
+    rows = np.concatenate([characters, newlines], axis=2)
+
+    # Assemble the whole view in memory so it is written with one call
+    return "".join(f"{a}\n" + angle_rows.tobytes().decode("ascii") for a, angle_rows in zip(angles, rows))
+
+
+# Write data to a temp file next to filename and rename it into place, so a crash never
+# leaves a half-written file behind under the real name
+def write_file_atomic(filename, data, mode='w'):
+    temp_filename = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(temp_filename, mode) as file:
+            file.write(data)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
+# Round like the builtin round() on Python floats, which np.round does not always match
+def python_round(values, ndigits):
+    unique_values, inverse = np.unique(values, return_inverse=True)
+    rounded = np.array([round(v, ndigits) for v in unique_values.tolist()], dtype=np.float64)
+    return rounded[inverse.reshape(-1)]
+
+
+# Index of each value in a sorted array of candidates, or -1 where there is no exact match
+def index_of(candidates, values):
+    if len(candidates) == 0:
+        return np.full(len(values), -1)
+    index = np.minimum(np.searchsorted(candidates, values), len(candidates) - 1)
+    return np.where(candidates[index] == values, index, -1)
 
 
 def remove_near_duplicates(numbers, tolerance=0.01):
@@ -283,7 +699,13 @@ def get_quadrants(center,max_range):
     return quadrants
 
 
+# Debug view of a point cloud. matplotlib is optional and only imported here
 def plot_3d_points(points):
+    try:
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise ImportError("plot_3d_points needs matplotlib: pip install matplotlib") from None
+
     # Separate the x, y, and z coordinates from the list of points
     x_coords = [point[0] for point in points]
     y_coords = [point[1] for point in points]
@@ -342,5 +764,1203 @@ def clear_folder(folder_path):
                 elif os.path.isdir(file_path):
                     shutil.rmtree(file_path)  # Remove directory and all its contents
             except Exception as e:
-                print(f'Failed to delete {file_path}. Reason: {e}'
+                print(f'Failed to delete {file_path}. Reason: {e}')
+
+
+
+### MESH SIMPLIFICATION ###
+# Photogrammetry and lidar exports carry far more triangles than the scan can see: the finest view
+# (a quadrant) samples the cave every (max_range + 2 * margin) / (grid_size - 1) / 2 units. With
+# simplify=True the OBJ is read line by line into flat arrays, duplicate vertices are merged and the
+# mesh is decimated by vertex clustering on a grid SIMPLIFY_OVERSAMPLE times finer than that spacing.
+# The result is saved as {name}.reduced.npz next to the OBJ and reused while the OBJ and settings match.
+# compare_simplified reports how many sample points the reduced mesh classifies differently
+SIMPLIFY_OVERSAMPLE = 4
+SIMPLIFY_VERSION = 1
+
+
+# Vertices and triangles of an OBJ file without building a scene. Polygons are split into fans,
+# texture and normal indices are dropped
+def load_obj_arrays(obj_file):
+    vertices = array("d")
+    faces = array("q")
+    vertex_count = 0
+    with open(obj_file) as file:
+        for line in file:
+            if line.startswith("v "):
+                x, y, z = line.split()[1:4]
+                vertices.extend((float(x), float(y), float(z)))
+                vertex_count += 1
+            elif line.startswith("f "):
+                corners = [int(corner.split("/")[0]) for corner in line.split()[1:]]
+                corners = [c - 1 if c > 0 else vertex_count + c for c in corners]  # Negative indices count back
+                for i in range(1, len(corners) - 1):
+                    faces.extend((corners[0], corners[i], corners[i + 1]))
+    return (np.frombuffer(vertices, dtype=np.float64).reshape(-1, 3),
+            np.frombuffer(faces, dtype=np.int64).reshape(-1, 3))
+
+
+# Drop collapsed triangles and coincident pairs. Two triangles on the same three vertices are two
+# walls on top of each other that cancel in the ray parity test, so they are removed together
+def clean_faces(faces):
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    _, first, counts = np.unique(np.sort(faces, axis=1), axis=0, return_index=True, return_counts=True)
+    return faces[np.sort(first[counts % 2 == 1])]
+
+
+# Keep only referenced vertices, merging those that share a position
+def merge_vertices(vertices, faces, digits=9):
+    used = np.unique(faces)
+    scale = np.ptp(vertices[used], axis=0).max() or 1.0
+    keys = np.round(vertices[used] / scale, digits)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    remap = np.zeros(len(vertices), dtype=np.int64)
+    remap[used] = inverse.reshape(-1)
+    return vertices[used][first], clean_faces(remap[faces])
+
+
+# Collapse all vertices within each cube of side cell onto their mean
+def cluster_vertices(vertices, faces, cell):
+    cells = np.floor((vertices - vertices.min(axis=0)) / cell).astype(np.int64)
+    _, inverse = np.unique(cells, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    counts = np.bincount(inverse)
+    clustered = np.column_stack([np.bincount(inverse, weights=vertices[:, axis]) for axis in range(3)]) / counts[:, None]
+    return merge_vertices(clustered, clean_faces(inverse[faces]))
+
+
+def get_surface_area(vertices, faces, chunk_size=1 << 20):
+    area = 0.0
+    for start in range(0, len(faces), chunk_size):
+        triangles = vertices[faces[start:start + chunk_size]]
+        area += 0.5 * np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]), axis=1).sum()
+    return area
+
+
+# Triangles needed to cover the surface at SIMPLIFY_OVERSAMPLE times the finest sample spacing,
+# and that cell size
+def get_triangle_budget(area, max_range, grid_size=16, margin=0.1, oversample=SIMPLIFY_OVERSAMPLE):
+    spacing = 0.5 * (max_range + 2 * margin) / (grid_size - 1)
+    cell = spacing / oversample
+    return int(np.ceil(2 * area / cell ** 2)), cell
+
+
+# Decimate to at most budget triangles, starting from cells of side cell and growing them as needed
+def decimate_mesh(vertices, faces, budget, cell):
+    while len(faces) > budget:
+        vertices, faces = cluster_vertices(vertices, faces, cell)
+        cell *= 1.25
+    return vertices, faces
+
+
+# Reduced mesh of an OBJ and the bounds of the full mesh, so the sampling grid does not move
+def load_simplified_mesh(obj_file, grid_size=16, margin=0.1, oversample=SIMPLIFY_OVERSAMPLE):
+    digest = hash_file(obj_file)
+    digest.update(json.dumps({"version": SIMPLIFY_VERSION, "grid_size": grid_size, "margin": margin,
+                              "oversample": oversample}, sort_keys=True).encode())
+    key = digest.hexdigest()
+    cache_file = os.path.splitext(obj_file)[0] + ".reduced.npz"
+    try:
+        with np.load(cache_file) as cached:
+            if str(cached["key"]) == key:
+                mesh = trimesh.Trimesh(vertices=cached["vertices"], faces=cached["faces"], process=False)
+                return mesh, cached["bounds"]
+    except (OSError, KeyError, ValueError):
+        pass
+
+    vertices, faces = merge_vertices(*load_obj_arrays(obj_file))
+    bounds = np.array([vertices.min(axis=0), vertices.max(axis=0)])
+    budget, cell = get_triangle_budget(get_surface_area(vertices, faces), max(bounds[1] - bounds[0]),
+                                       grid_size=grid_size, margin=margin, oversample=oversample)
+    full_count = len(faces)
+    vertices, faces = decimate_mesh(vertices, faces, budget, cell)
+    print(f"{os.path.basename(obj_file)}: {full_count} triangles reduced to {len(faces)} (budget {budget})")
+
+    buffer = io.BytesIO()
+    np.savez(buffer, key=key, vertices=vertices, faces=faces, bounds=bounds)
+    try:
+        write_file_atomic(cache_file, buffer.getvalue(), mode='wb')
+    except OSError as e:
+        print(f"Could not cache the reduced mesh next to {obj_file}: {e}")
+    return trimesh.Trimesh(vertices=vertices, faces=faces, process=False), bounds
+
+
+# Number of sample points of each view the reduced mesh classifies differently from the full mesh
+def compare_simplified(obj_file, backend="ray", voxel_resolution=128, grid_size=16, num_rotations=55,
+                       oversample=SIMPLIFY_OVERSAMPLE):
+    mesh = trimesh.load(obj_file)
+    reduced, (min_val, max_val) = load_simplified_mesh(obj_file, grid_size=grid_size, oversample=oversample)
+    if backend == "ray":
+        backend = "culled"  # Same answers as ray, without ray's candidate arrays growing with the full mesh
+    reference = get_containment(mesh, backend=backend, resolution=voxel_resolution)
+    candidate = get_containment(reduced, backend=backend, resolution=voxel_resolution)
 
+    max_range = max(max_val - min_val)
+    center = (min_val + max_val) / 2.0
+    base_grid = generate_base_grid(cube_size=grid_size, num_rotations=num_rotations, center=center, max_range=max_range)
+    views = get_scan_views(base_grid, center, get_quadrants(center=center, max_range=max_range))
+
+    report = {}
+    for label, (grid, location) in views.items():
+        points = grid + np.asarray(location)
+        report[label] = int(np.count_nonzero(reference(points) != candidate(points)))
+
+    total = len(base_grid) * len(views)
+    changed = sum(report.values())
+    print(f"{os.path.basename(obj_file)}: {len(mesh.faces)} -> {len(reduced.faces)} triangles, "
+          f"{changed} of {total} points changed ({100 * changed / total:.2f}%)")
+    return report
+
+
+### INSTRUMENTATION ###
+# Pass report=new_scan_report() to scan_obj to find out where a conversion spends its time. Every
+# stage appends {"name", "wall", "cpu", "peak_memory", "max_rss"} to report["stages"], in order:
+#   cache_lookup, load, grid, containment_setup, cache_store       once per conversion
+#   contains:<view>, encode:<view>, write:<view>                   per view (contains:all for a batched scan)
+# and report["views"] gets the point count and inside ratio of every view. peak_memory is the peak of
+# Python and numpy allocations during the stage, only measured with trace_memory=True as tracing makes
+# the ray backend many times slower; max_rss is the process high water mark so far. Stages named in profile_stages
+# (by their part before ":") run under cProfile and their stats are dumped to profile_folder.
+# With report=None every stage is a shared no-op context, so instrumentation costs next to nothing
+_NO_STAGE = contextlib.nullcontext()
+
+
+def new_scan_report(trace_memory=False, profile_stages=(), profile_folder="profiles"):
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return {"stages": [], "views": {}, "trace_memory": trace_memory,
+            "profile_stages": list(profile_stages), "profile_folder": profile_folder}
+
+
+def measure_stage(report, name):
+    if report is None:
+        return _NO_STAGE
+    return _measure_stage(report, name)
+
+
+@contextlib.contextmanager
+def _measure_stage(report, name):
+    profiler = None
+    if name.split(":")[0] in report["profile_stages"]:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if report["trace_memory"]:
+        tracemalloc.reset_peak()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        stage = {
+            "name": name,
+            "wall": time.perf_counter() - wall,
+            "cpu": time.process_time() - cpu,
+            "peak_memory": tracemalloc.get_traced_memory()[1] if report["trace_memory"] else None,
+            "max_rss": get_max_rss(),
+        }
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(report["profile_folder"], exist_ok=True)
+            stage["profile"] = os.path.join(report["profile_folder"], f"{name.replace(':', '_')}.prof")
+            profiler.dump_stats(stage["profile"])
+        report["stages"].append(stage)
+
+
+# Peak resident memory of this process in bytes, None where the resource module is missing (Windows)
+def get_max_rss():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024  # Linux reports kilobytes
+
+
+def record_view(report, label, is_inside):
+    if report is None:
+        return
+    inside = int(np.count_nonzero(is_inside))
+    report["views"][label] = {"points": len(is_inside), "inside": inside,
+                              "inside_ratio": inside / len(is_inside) if len(is_inside) else 0.0}
+
+
+# Stage totals (views summed per stage kind) and the slowest views, as printable text
+def format_scan_report(report):
+    totals = {}
+    for stage in report["stages"]:
+        kind = stage["name"].split(":")[0]
+        wall, cpu, peak = totals.get(kind, (0.0, 0.0, 0))
+        totals[kind] = (wall + stage["wall"], cpu + stage["cpu"], max(peak, stage["peak_memory"] or 0))
+
+    lines = [f"{'stage':<18}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}"]
+    for kind, (wall, cpu, peak) in totals.items():
+        peak_text = f"{peak / 2 ** 20:.1f}" if report["trace_memory"] else "-"
+        lines.append(f"{kind:<18}{wall:>10.3f}{cpu:>10.3f}{peak_text:>10}")
+    if report["stages"] and report["stages"][-1]["max_rss"] is not None:
+        lines.append(f"max resident memory: {report['stages'][-1]['max_rss'] / 2 ** 20:.1f} MB")
+
+    slowest = sorted((s for s in report["stages"] if s["name"].startswith("contains:")), key=lambda s: -s["wall"])
+    for stage in slowest[:3]:
+        label = stage["name"].split(":", 1)[1]
+        view = report["views"].get(label)
+        inside_text = f", {view['points']} points, {100 * view['inside_ratio']:.1f}% inside" if view else ""
+        lines.append(f"slowest contains {label}: {stage['wall']:.3f}s{inside_text}")
+    return "\n".join(lines)
+
+
+### ZOOM VIEWS ###
+# Deeper zoom levels are addressed by a path of quadrant labels, each one zooming into that
+# quadrant of the previous view, e.g. "Middle-Center-Middle/Top-Left-Near". An empty path is
+# the full view. Every level halves the range, so views are only generated when asked for.
+ZOOM_SEPARATOR = "/"
+
+# Location, range and grid scale of the view at path
+def get_zoom_region(center, max_range, path):
+    location = (center[0], center[1], center[2])
+    view_range = max_range
+    scale = 1.0
+    for quadrant_label in filter(None, path.split(ZOOM_SEPARATOR)):
+        quadrants = get_quadrants(center=location, max_range=view_range)
+        if quadrant_label not in quadrants:
+            raise ValueError(f"Unknown quadrant {quadrant_label!r} in zoom path {path!r}")
+        location = quadrants[quadrant_label]
+        view_range /= 2
+        scale *= 0.5
+    return location, view_range, scale
+
+
+# File label of a zoom path, the full view keeps its usual name
+def get_zoom_label(path):
+    return path.replace(ZOOM_SEPARATOR, "_") if path else "full_obj"
+
+
+# Load a cave for lazy zoom view generation. The returned state is passed to get_zoom_view
+# and list_zoom_children, and remembers every view generated or pruned so far
+def open_zoom_views(obj_file, backend="ray", voxel_resolution=128, grid_size=16, num_rotations=55,
+                    margin=0.1, output_dir="output_folder"):
+    mesh = trimesh.load(obj_file)
+    min_val, max_val = mesh.bounds[0], mesh.bounds[1]
+    max_range = max(max_val - min_val)
+    triangles = mesh.triangles
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    return {
+        "mesh": mesh,
+        "contains": get_containment(mesh, backend=backend, resolution=voxel_resolution),
+        "center": (min_val + max_val) / 2.0,
+        "max_range": max_range,
+        "margin": margin,
+        "base_grid": generate_base_grid(cube_size=grid_size, num_rotations=num_rotations,
+                                        max_range=max_range, margin=margin),
+        "polar_index": get_polar_index(grid_size=grid_size, num_rotations=num_rotations),
+        "face_min": triangles.min(axis=1),
+        "face_max": triangles.max(axis=1),
+        "output_dir": output_dir,
+        "views": {},  # path -> written filename, or None when the view was pruned
+        "pruned_inside": {},  # path of a pruned view -> True when all its LEDs are on, False when all are off
+    }
+
+
+# A view has geometry when the mesh surface passes through its sampling box. Without any
+# triangle in the box the whole view is on one side of the surface, so all its LEDs are off
+# or all are on (see get_zoom_view). Boxes outside the mesh bounds are ruled out first
+def zoom_view_has_geometry(zoom, path):
+    location, view_range, scale = get_zoom_region(zoom["center"], zoom["max_range"], path)
+    half_size = (zoom["max_range"] / 2 + zoom["margin"]) * scale
+    lower = np.asarray(location) - half_size
+    upper = np.asarray(location) + half_size
+
+    mesh_lower, mesh_upper = zoom["mesh"].bounds
+    if np.any(upper < mesh_lower) or np.any(lower > mesh_upper):
+        return False
+    return bool(np.any(np.all(zoom["face_max"] >= lower, axis=1) & np.all(zoom["face_min"] <= upper, axis=1)))
+
+
+# Children of the view at path that contain geometry, found without scanning them
+def list_zoom_children(zoom, path=""):
+    children = []
+    for quadrant_label in get_quadrants(center=(0, 0, 0), max_range=0):
+        child = f"{path}{ZOOM_SEPARATOR}{quadrant_label}" if path else quadrant_label
+        if zoom["views"].get(child, "") is not None and zoom_view_has_geometry(zoom, child):
+            children.append(child)
+    return children
+
+
+# Scan and write the view at path the first time it is asked for. Returns the view file, or
+# None when the view has no geometry and was pruned instead. A pruned view is entirely inside
+# or entirely outside the cave, which its center decides; zoom["pruned_inside"][path] records it
+def get_zoom_view(zoom, path=""):
+    if path in zoom["views"]:
+        return zoom["views"][path]
+
+    filename = None
+    location, view_range, scale = get_zoom_region(zoom["center"], zoom["max_range"], path)
+    if not zoom_view_has_geometry(zoom, path):
+        center = np.asarray([location], dtype=np.float64)
+        zoom["pruned_inside"][path] = bool(np.asarray(zoom["contains"](center), dtype=bool)[0])
+    else:
+        points = zoom["base_grid"] * scale + np.asarray(location, dtype=np.float64)
+        is_inside = np.asarray(zoom["contains"](points), dtype=bool)
+        label = get_zoom_label(path)
+        write_scan_bits(zoom["polar_index"].angles, encode_scan_bits(is_inside, zoom["polar_index"]),
+                        output_folder=zoom["output_dir"], label=label)
+        filename = os.path.join(zoom["output_dir"], f"{label}_output.txt")
+
+    zoom["views"][path] = filename
+    return filename
+
+
+### BINARY CAVE FORMAT ###
+# All views of a cave in one little-endian file the display can seek through directly:
+#   header      magic "CAVE", version, grid_size, num_rotations, slot_count, view_count, row_bytes (uint16 each)
+#   angles      slot_count x uint32, angle of each slot in thousandths of a degree
+#   view index  view_count x (64 byte NUL padded label, uint32 byte offset of the view from the file start)
+#   views       slot_count x grid_size rows per view, row_bytes each, every view aligned to 4 bytes
+CAVE_MAGIC = b"CAVE"
+CAVE_VERSION = 1
+CAVE_HEADER = struct.Struct("<4sHHHHHH")
+CAVE_INDEX_ENTRY = struct.Struct("<64sI")
+CAVE_ROW_TYPES = {1: "<u1", 2: "<u2", 4: "<u4", 8: "<u8"}
+
+# Write {label: bits} (bit volumes indexed by [angle slot, height row, bit]) as one binary cave file.
+# Rows wider than 64 LEDs are stored as several little-endian bytes
+def write_cave_binary(filename, angles, views, grid_size=16, num_rotations=55):
+    row_bytes = max(1, -(-grid_size // 8))
+
+    header = CAVE_HEADER.pack(CAVE_MAGIC, CAVE_VERSION, grid_size, num_rotations, len(angles), len(views), row_bytes)
+    angle_table = np.array([round(a * 1000) for a in angles], dtype="<u4").tobytes()
+
+    offset = CAVE_HEADER.size + len(angle_table) + CAVE_INDEX_ENTRY.size * len(views)
+    index = []
+    data = []
+    for label, rows in views.items():
+        if len(label.encode("ascii")) > 64:
+            raise ValueError(f"View label {label!r} is longer than 64 characters")
+        offset += -offset % 4
+        index.append(CAVE_INDEX_ENTRY.pack(label.encode("ascii"), offset))
+        view_data = np.packbits(np.asarray(rows, dtype=bool), axis=-1, bitorder="little").tobytes()
+        data.append(view_data.ljust(len(view_data) + -len(view_data) % 4, b"\0"))
+        offset += len(view_data)
+
+    write_file_atomic(filename, header + angle_table + b"".join(index) + b"".join(data), mode='wb')
+
+
+# Read a binary cave file through mmap. The view arrays are read-only windows onto the file:
+# integer rows when a row fits in 1, 2, 4 or 8 bytes, otherwise the raw row bytes
+def read_cave_binary(filename):
+    with open(filename, 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, grid_size, num_rotations, slot_count, view_count, row_bytes = CAVE_HEADER.unpack_from(buffer, 0)
+    if magic != CAVE_MAGIC:
+        raise ValueError(f"{filename} is not a binary cave file")
+    if version != CAVE_VERSION:
+        raise ValueError(f"{filename} has unsupported version {version}")
+
+    angles = np.frombuffer(buffer, dtype="<u4", count=slot_count, offset=CAVE_HEADER.size) / 1000
+    row_type = np.dtype(CAVE_ROW_TYPES.get(row_bytes, "u1"))
+    row_shape = (slot_count, grid_size) if row_bytes in CAVE_ROW_TYPES else (slot_count, grid_size, row_bytes)
+    views = {}
+    index_start = CAVE_HEADER.size + 4 * slot_count
+    for i in range(view_count):
+        label, offset = CAVE_INDEX_ENTRY.unpack_from(buffer, index_start + i * CAVE_INDEX_ENTRY.size)
+        rows = np.frombuffer(buffer, dtype=row_type, count=int(np.prod(row_shape)), offset=offset)
+        views[label.rstrip(b"\0").decode("ascii")] = rows.reshape(row_shape)
+
+    return {
+        "grid_size": grid_size,
+        "num_rotations": num_rotations,
+        "angles": angles.tolist(),
+        "views": views,
+    }
+
+
+# Parse a text view file back into its angle headers and bit volume
+def read_scan_output_file(filename):
+    with open(filename) as file:
+        lines = file.read().split()
+
+    is_row = [set(line) <= {"0", "1"} for line in lines]
+    angles = [float(line) for line, row in zip(lines, is_row) if not row]
+    row_lines = [line for line, row in zip(lines, is_row) if row]
+    if not angles or len(row_lines) % len(angles) != 0:
+        raise ValueError(f"{filename} does not have the same number of rows for every angle")
+
+    width = len(row_lines[0]) if row_lines else 0
+    characters = np.frombuffer("".join(row_lines).encode("ascii"), dtype=np.uint8).reshape(len(angles), -1, width)
+    return angles, characters[:, :, ::-1] == ord("1")
+
+
+# Convert a folder of {label}_output.txt files into one binary cave file, views in scan order
+def convert_text_to_binary(folder, filename=None, num_rotations=55):
+    if filename is None:
+        filename = os.path.join(folder, "cave.bin")
+
+    view_files = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith("_output.txt")]
+    if not view_files:
+        raise ValueError(f"No view files found in {folder}")
+    return pack_view_files(view_files, filename, num_rotations=num_rotations)
+
+
+### DELTA FRAMES ###
+# Compressed form of one view for streaming off the SD card. Neighbouring angle frames are
+# usually identical or close, so each frame is stored as one of
+#   FRAME_KEY     the raw frame (every keyframe_interval frames, or when a delta would not be smaller)
+#   FRAME_REPEAT  no payload, same as the previous frame
+#   FRAME_DELTA   XOR with the previous frame, run-length coded as packets of
+#                 (zero bytes to skip: uint8, literal count: uint8, literal bytes)
+# Layout: header (magic "CDLT", version, grid_size, slot_count, row_bytes, keyframe_interval, reserved: uint16 each),
+# angles (slot_count x uint32 thousandths of a degree), frame offsets (slot_count x uint32 from the file start),
+# then per frame a uint8 type, a uint16 payload length and the payload. A frame is grid_size rows of row_bytes
+# little-endian bytes, as in cave.bin
+DELTA_MAGIC = b"CDLT"
+DELTA_VERSION = 1
+DELTA_HEADER = struct.Struct("<4sHHHHHH")
+DELTA_FRAME = struct.Struct("<BH")
+FRAME_KEY, FRAME_REPEAT, FRAME_DELTA = 0, 1, 2
+
+# Run-length code the zero bytes of an XOR delta
+def encode_zero_runs(delta):
+    packets = bytearray()
+    i = 0
+    while i < len(delta):
+        zeros = 0
+        while i < len(delta) and delta[i] == 0 and zeros < 255:
+            zeros += 1
+            i += 1
+        start = i
+        # Take literals until the next pair of zero bytes, where a new packet is cheaper
+        while i < len(delta) and i - start < 255 and not (delta[i] == 0 and (i + 1 == len(delta) or delta[i + 1] == 0)):
+            i += 1
+        packets += bytes((zeros, i - start)) + delta[start:i]
+    return bytes(packets)
+
+
+def decode_zero_runs(packets, size):
+    delta = bytearray(size)
+    position = 0
+    i = 0
+    while i < len(packets):
+        zeros, count = packets[i], packets[i + 1]
+        position += zeros
+        delta[position:position + count] = packets[i + 2:i + 2 + count]
+        position += count
+        i += 2 + count
+    return bytes(delta)
+
+
+# Encode a view's bit volume ([angle slot, height row, bit]) as a delta frame stream
+def encode_delta_frames(angles, bits, keyframe_interval=16):
+    if not 1 <= keyframe_interval <= 0xFFFF:
+        raise ValueError(f"keyframe_interval must be between 1 and 65535, got {keyframe_interval}")
+    bits = np.asarray(bits, dtype=bool)
+    slot_count, grid_size = bits.shape[0], bits.shape[1]
+    row_bytes = max(1, -(-bits.shape[2] // 8))
+    frames = np.packbits(bits, axis=-1, bitorder="little").reshape(slot_count, -1)
+
+    header = DELTA_HEADER.pack(DELTA_MAGIC, DELTA_VERSION, grid_size, slot_count, row_bytes, keyframe_interval, 0)
+    angle_table = np.array([round(a * 1000) for a in angles], dtype="<u4").tobytes()
+    offset = len(header) + len(angle_table) + 4 * slot_count
+
+    offsets = []
+    data = []
+    for i, frame in enumerate(frames):
+        frame_type, payload = FRAME_KEY, frame.tobytes()
+        if i % keyframe_interval != 0:
+            delta = np.bitwise_xor(frame, frames[i - 1])
+            if not delta.any():
+                frame_type, payload = FRAME_REPEAT, b""
+            else:
+                packets = encode_zero_runs(delta.tobytes())
+                if len(packets) < len(payload):
+                    frame_type, payload = FRAME_DELTA, packets
+        offsets.append(offset)
+        data.append(DELTA_FRAME.pack(frame_type, len(payload)) + payload)
+        offset += DELTA_FRAME.size + len(payload)
+
+    return header + angle_table + np.array(offsets, dtype="<u4").tobytes() + b"".join(data)
+
+
+# Reference decoder: delta frame stream back to (angles, bit volume)
+def decode_delta_frames(data):
+    magic, version, grid_size, slot_count, row_bytes, keyframe_interval, _ = DELTA_HEADER.unpack_from(data, 0)
+    if magic != DELTA_MAGIC:
+        raise ValueError("Not a delta frame stream")
+    if version != DELTA_VERSION:
+        raise ValueError(f"Unsupported delta frame version {version}")
+
+    angles = (np.frombuffer(data, dtype="<u4", count=slot_count, offset=DELTA_HEADER.size) / 1000).tolist()
+    offsets = np.frombuffer(data, dtype="<u4", count=slot_count, offset=DELTA_HEADER.size + 4 * slot_count)
+    frame_size = grid_size * row_bytes
+
+    frames = np.zeros((slot_count, frame_size), dtype=np.uint8)
+    for i, offset in enumerate(offsets.tolist()):
+        frame_type, length = DELTA_FRAME.unpack_from(data, offset)
+        payload = data[offset + DELTA_FRAME.size:offset + DELTA_FRAME.size + length]
+        if frame_type == FRAME_KEY:
+            frames[i] = np.frombuffer(payload, dtype=np.uint8)
+        elif frame_type == FRAME_REPEAT:
+            frames[i] = frames[i - 1]
+        elif frame_type == FRAME_DELTA:
+            frames[i] = frames[i - 1] ^ np.frombuffer(decode_zero_runs(payload, frame_size), dtype=np.uint8)
+        else:
+            raise ValueError(f"Unknown frame type {frame_type} at frame {i}")
+
+    bits = np.unpackbits(frames.reshape(slot_count, grid_size, row_bytes), axis=-1, bitorder="little")
+    return angles, bits[:, :, :grid_size].astype(bool)
+
+
+# Compress one text view into {label}_output.dlt next to it and prove the round trip is lossless.
+# Returns (text bytes, packed frame bytes, compressed bytes)
+def compress_view_file(text_file, keyframe_interval=16):
+    angles, bits = read_scan_output_file(text_file)
+    data = encode_delta_frames(angles, bits, keyframe_interval=keyframe_interval)
+
+    decoded_angles, decoded_bits = decode_delta_frames(data)
+    with open(text_file) as file:
+        if format_scan_bits(decoded_angles, decoded_bits) != file.read():
+            raise ValueError(f"Delta frames of {text_file} do not decode back to the same view")
+
+    write_file_atomic(text_file[:-len(".txt")] + ".dlt", data, mode='wb')
+    packed_size = bits.shape[0] * bits.shape[1] * max(1, -(-bits.shape[2] // 8))
+    return os.path.getsize(text_file), packed_size, len(data)
+
+
+# Compress every view in a folder and print the compression ratio of each
+def compress_views(folder, keyframe_interval=16):
+    report = {}
+    for name in sorted(os.listdir(folder)):
+        if name.endswith("_output.txt"):
+            label = name[:-len("_output.txt")]
+            report[label] = compress_view_file(os.path.join(folder, name), keyframe_interval=keyframe_interval)
+            text_size, packed_size, compressed_size = report[label]
+            print(f"{label}: {text_size} text bytes, {packed_size} packed, {compressed_size} delta "
+                  f"({packed_size / compressed_size:.1f}x packed, {text_size / compressed_size:.1f}x text)")
+    return report
+
+
+### SD CARD SYNC ###
+# The card keeps a manifest of the SHA-256, size and cave of every file synced to it. A sync only copies
+# files whose hash changed, removes stale files (their source is gone from the library, or their cave
+# is being synced again without them) and flushes the card once at the end. Caves that are not part
+# of a sync stay on the card as they are
+SYNC_MANIFEST = "sync_manifest.json"
+
+
+# SHA-256 of a file, read in 1 MB blocks
+def hash_file(filename, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest
+
+
+def read_sync_manifest(card_folder):
+    try:
+        with open(os.path.join(card_folder, SYNC_MANIFEST)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}  # No manifest yet or an unreadable one: every file counts as changed
+
+
+# Flush everything written to the card in one go instead of once per file
+def flush_card(filenames):
+    if hasattr(os, "sync"):
+        os.sync()
+        return
+    for filename in filenames:
+        with open(filename, 'rb+') as file:
+            os.fsync(file.fileno())
+
+
+# Pack view files into one binary cave file (see BINARY CAVE FORMAT), so the card holds a single
+# file per cave instead of one per view
+def pack_view_files(view_files, filename, num_rotations=55):
+    scan_order = {label: i for i, label in enumerate(get_view_labels())}
+    labelled = sorted(((os.path.basename(view_file)[:-len("_output.txt")], view_file) for view_file in view_files),
+                      key=lambda item: (scan_order.get(item[0], len(scan_order)), item[0]))
+
+    views = {}
+    angles = None
+    for label, view_file in labelled:
+        angles, views[label] = read_scan_output_file(view_file)
+    if angles is None:
+        raise ValueError("No view files to pack")
+
+    grid_size = next(iter(views.values())).shape[2]
+    write_cave_binary(filename, angles, views, grid_size=grid_size, num_rotations=num_rotations)
+    return filename
+
+
+# Make card_folder hold exactly the given files of library_folder, each at the same path relative to the
+# library (<cave>/<view>) so caves with the same view names do not overwrite each other. With bundle=True
+# the view files of every cave are packed into one <cave>.bin first. Returns the card paths that were
+# copied, skipped as unchanged and deleted as stale
+def sync_files(files, library_folder, card_folder, bundle=False, delete_stale=True, num_rotations=55):
+    sources = {}
+    source_caves = {}
+    bundles = set()
+    with tempfile.TemporaryDirectory() as bundle_folder:
+        caves = {}
+        for source in files:
+            name = os.path.relpath(source, library_folder).replace(os.sep, "/")
+            if name.startswith("../"):
+                raise ValueError(f"{source} is not in {library_folder}")
+            if bundle and name.endswith("_output.txt"):
+                caves.setdefault(posixpath.dirname(name), []).append(source)
+                continue
+            if sources.setdefault(name, source) != source:
+                raise ValueError(f"{source} and {sources[name]} would both be synced to {name}")
+            source_caves[name] = posixpath.dirname(name)
+        for i, (cave, view_files) in enumerate(caves.items()):
+            name = f"{cave or 'cave'}.bin"
+            packed = pack_view_files(view_files, os.path.join(bundle_folder, f"{i}.bin"), num_rotations)
+            if sources.setdefault(name, packed) != packed:
+                raise ValueError(f"The views of {cave or library_folder} and {sources[name]} would both be synced to {name}")
+            source_caves[name] = cave
+            bundles.add(name)
+
+        manifest = read_sync_manifest(card_folder)
+        synced = {}
+        report = {"copied": [], "skipped": [], "deleted": []}
+        for name, source in sources.items():
+            entry = {"sha256": hash_file(source).hexdigest(), "size": os.path.getsize(source), "cave": source_caves[name]}
+            if name in bundles:
+                entry["bundle"] = True  # Its source is the cave folder, not a file of the library
+            destination = os.path.join(card_folder, *name.split("/"))
+            previous = manifest.get(name, {})
+            if (previous.get("sha256") == entry["sha256"] and previous.get("size") == entry["size"]
+                    and os.path.exists(destination) and os.path.getsize(destination) == entry["size"]):
+                report["skipped"].append(name)
+            else:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                with open(source, 'rb') as file:
+                    write_file_atomic(destination, file.read(), mode='wb')  # One large write per file
+                report["copied"].append(name)
+            synced[name] = entry
+
+    synced_caves = {entry["cave"] for entry in synced.values()}
+    for name, entry in manifest.items():
+        if name in synced:
+            continue
+        cave = entry.get("cave", posixpath.dirname(name))
+        source = os.path.join(library_folder, *(cave if entry.get("bundle") else name).split("/"))
+        if not delete_stale or (cave not in synced_caves and os.path.exists(source)):
+            synced[name] = entry  # Another cave that is still in the library
+            continue
+        stale_file = os.path.join(card_folder, *name.split("/"))
+        if os.path.exists(stale_file):
+            os.remove(stale_file)
+            stale_folder = os.path.dirname(stale_file)
+            if os.path.normpath(stale_folder) != os.path.normpath(card_folder) and not os.listdir(stale_folder):
+                os.rmdir(stale_folder)  # Last file of a cave that is gone or now bundled
+        report["deleted"].append(name)
+
+    manifest_file = os.path.join(card_folder, SYNC_MANIFEST)
+    write_file_atomic(manifest_file, json.dumps(synced, indent=1, sort_keys=True))
+    flush_card([os.path.join(card_folder, *name.split("/")) for name in report["copied"]] + [manifest_file])
+    return report
+
+
+### CAVE CATALOG ###
+# A library folder (cave_data in the app, --out on the command line) holds one sub folder per cave
+# and catalog.json describing them, so listing the library is one file read however many caves it has:
+#   {"version": 1, "caves": {cave name: {"views": [file names], "mesh_sha256": ..., "source": ...,
+#                                        "parameters": {...}, "size": bytes, "created": unix time}}}
+# Entries are added as caves are converted. The folders are only listed when there is no catalog yet
+CATALOG_FILE = "catalog.json"
+CATALOG_VERSION = 1
+
+
+def read_catalog(library_folder):
+    try:
+        with open(os.path.join(library_folder, CATALOG_FILE)) as file:
+            catalog = json.load(file)
+        if catalog.get("version") == CATALOG_VERSION:
+            return catalog
+    except (OSError, ValueError):
+        pass
+    return rebuild_catalog(library_folder)
+
+
+def write_catalog(library_folder, catalog):
+    os.makedirs(library_folder, exist_ok=True)
+    write_file_atomic(os.path.join(library_folder, CATALOG_FILE), json.dumps(catalog, indent=1, sort_keys=True))
+
+
+# Catalog entry for one converted cave folder
+def get_catalog_entry(cave_folder, source_file=None, parameters=None):
+    views = sorted(name for name in os.listdir(cave_folder) if not name.endswith(".tmp"))
+    return {
+        "views": views,
+        "mesh_sha256": hash_file(source_file).hexdigest() if source_file else None,
+        "source": os.path.abspath(source_file) if source_file else None,
+        "parameters": parameters or {},
+        "size": sum(os.path.getsize(os.path.join(cave_folder, name)) for name in views),
+        "created": os.path.getmtime(cave_folder),
+    }
+
+
+# Record a cave that was just converted into library_folder/cave_name and return the updated catalog
+def add_to_catalog(library_folder, cave_name, source_file=None, parameters=None):
+    catalog = read_catalog(library_folder)
+    catalog["caves"][cave_name] = get_catalog_entry(os.path.join(library_folder, cave_name), source_file, parameters)
+    write_catalog(library_folder, catalog)
+    return catalog
+
+
+# Catalog every cave folder in the library, for libraries converted before the catalog existed.
+# Source hashes and parameters are unknown for these
+def rebuild_catalog(library_folder):
+    catalog = {"version": CATALOG_VERSION, "caves": {}}
+    if not os.path.isdir(library_folder):
+        return catalog
+    for name in sorted(os.listdir(library_folder)):
+        cave_folder = os.path.join(library_folder, name)
+        if os.path.isdir(cave_folder):
+            catalog["caves"][name] = get_catalog_entry(cave_folder)
+    write_catalog(library_folder, catalog)
+    return catalog
+
+
+### PREVIEW AND VALIDATION ###
+# Check converted views without rescanning. A view decodes to a bit volume [angle slot, height row,
+# bit] (see encode_scan_bits); bit b >= grid_size / 2 is b - grid_size / 2 + 0.5 LED spacings out from
+# the axis at the slot's angle and lower bits are on the opposite side, so the volume is the cave in
+# (angle, height, radius) form. Previews draw every height row of a view as a top down slice.
+# Pillow is only imported when a preview is rendered
+VALIDATE_MAX_PROBLEMS = 10  # Problems listed per file, a misaligned file would list every angle
+
+
+# Bit volume of binary cave rows (see BINARY CAVE FORMAT), bit b of a row is LED b
+def unpack_cave_rows(rows, grid_size):
+    if rows.ndim == 3:
+        return np.unpackbits(rows, axis=-1, bitorder="little")[:, :, :grid_size].astype(bool)
+    shifts = np.arange(grid_size, dtype=np.uint64)
+    return (rows.astype(np.uint64)[:, :, None] >> shifts) & np.uint64(1) == 1
+
+
+# Decode a text view, a folder of them or a cave.bin into {label: (angles, bit volume)}
+def read_views(path):
+    if os.path.isdir(path):
+        return {name[:-len("_output.txt")]: read_scan_output_file(os.path.join(path, name))
+                for name in sorted(os.listdir(path)) if name.endswith("_output.txt")}
+    if path.endswith(".bin"):
+        cave = read_cave_binary(path)
+        return {label: (cave["angles"], unpack_cave_rows(rows, cave["grid_size"])) for label, rows in cave["views"].items()}
+    return {os.path.basename(path)[:-len("_output.txt")]: read_scan_output_file(path)}
+
+
+# Structure problems of one text view: the number of angles, the angle headers, the number of rows
+# per angle and their width and characters. Returns a list of messages, empty when the file is good
+def validate_view_file(filename, grid_size=16, num_rotations=55):
+    expected_angles = get_polar_index(grid_size=grid_size, num_rotations=num_rotations).angles
+    with open(filename) as file:
+        lines = file.read().split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+
+    problems = []
+    block = grid_size + 1
+    if len(lines) != len(expected_angles) * block:
+        problems.append(f"{len(lines)} lines, expected {len(expected_angles)} angles of {grid_size} rows "
+                        f"({len(expected_angles) * block} lines)")
+    for slot, start in enumerate(range(0, len(lines), block)):
+        header, rows = lines[start], lines[start + 1:start + block]
+        try:
+            angle = float(header)
+        except ValueError:
+            angle = None
+        if angle is None or set(header) <= {"0", "1"}:
+            problems.append(f"line {start + 1}: {header!r} is not an angle")
+            continue
+        if slot < len(expected_angles) and abs(angle - expected_angles[slot]) > 1e-3:
+            problems.append(f"line {start + 1}: angle {angle}, expected {expected_angles[slot]}")
+        if len(rows) != grid_size:
+            problems.append(f"angle {angle}: {len(rows)} rows, expected {grid_size}")
+        for row_number, row in enumerate(rows, start=start + 2):
+            if len(row) != grid_size or not set(row) <= {"0", "1"}:
+                problems.append(f"line {row_number}: {row!r} is not a row of {grid_size} LEDs")
+                break  # One bad row per angle is enough to report
+    if len(problems) > VALIDATE_MAX_PROBLEMS:
+        problems = problems[:VALIDATE_MAX_PROBLEMS] + [f"and {len(problems) - VALIDATE_MAX_PROBLEMS} more problems"]
+    return problems
+
+
+# Validate every view of a cave folder (also checking that all views are there), every cave folder
+# of a library, single view files and cave.bin files. Returns {path: [problems]} for the bad ones
+def validate_views(paths, grid_size=16, num_rotations=55):
+    results = {}
+    for path in paths:
+        if path.endswith(".bin"):
+            try:
+                cave = read_cave_binary(path)
+            except (ValueError, struct.error) as e:
+                results[path] = [str(e)]
+                continue
+            problems = []
+            if (cave["grid_size"], cave["num_rotations"]) != (grid_size, num_rotations):
+                problems.append(f"scanned at grid size {cave['grid_size']} and {cave['num_rotations']} rotations, "
+                                f"expected {grid_size} and {num_rotations}")
+            missing = [label for label in get_view_labels() if label not in cave["views"]]
+            if missing:
+                problems.append(f"missing views: {', '.join(missing)}")
+            if problems:
+                results[path] = problems
+        elif os.path.isdir(path):
+            names = os.listdir(path)
+            if not any(name.endswith("_output.txt") for name in names):
+                results.update(validate_views(sorted(os.path.join(path, name) for name in names
+                                                     if os.path.isdir(os.path.join(path, name))), grid_size, num_rotations))
+                continue
+            missing = [label for label in get_view_labels() if f"{label}_output.txt" not in names]
+            if missing:
+                results[path] = [f"missing views: {', '.join(missing)}"]
+            results.update(validate_views(sorted(os.path.join(path, name) for name in names
+                                                 if name.endswith("_output.txt")), grid_size, num_rotations))
+        else:
+            problems = validate_view_file(path, grid_size, num_rotations)
+            if problems:
+                results[path] = problems
+    return results
+
+
+# Draw the height rows of one view as top down slices, side by side in rows of columns, as a
+# uint8 array. Every lit LED is splatted as a dot at its polar position, all at once
+def render_view_slices(angles, bits, cell=48, columns=4, dot=1):
+    slot_count, row_count, grid_size = bits.shape
+    half = grid_size / 2
+    scale = (cell / 2 - dot - 1) / half
+    theta = np.radians(np.asarray(angles, dtype=np.float64))[:, None]
+    radius = np.arange(grid_size) - half + 0.5  # Signed: the low bits are on the far side of the axis
+    x = np.rint(cell / 2 + radius * np.cos(theta) * scale).astype(np.int64)
+    y = np.rint(cell / 2 - radius * np.sin(theta) * scale).astype(np.int64)
+
+    image = np.full((-(-row_count // columns) * cell, columns * cell), 24, dtype=np.uint8)
+    for row in range(row_count):
+        top, left = (row // columns) * cell, (row % columns) * cell
+        image[top + 1:top + cell - 1, left + 1:left + cell - 1] = 48  # Slice background
+
+    slot, row, bit = np.nonzero(bits)
+    offsets = np.arange(-dot, dot + 1)
+    pixel_y = (row // columns * cell + y[slot, bit])[:, None, None] + offsets[None, :, None]
+    pixel_x = (row % columns * cell + x[slot, bit])[:, None, None] + offsets[None, None, :]
+    image[pixel_y, pixel_x] = 255
+    return image
+
+
+# Render every view of a cave as one PNG contact sheet, views in scan order with their labels
+def render_contact_sheet(views, filename, cell=48, sheet_columns=7):
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        raise ImportError("Previews need Pillow: pip install pillow") from None
+
+    scan_order = {label: i for i, label in enumerate(get_view_labels())}
+    labels = sorted(views, key=lambda label: (scan_order.get(label, len(scan_order)), label))
+    tiles = [render_view_slices(*views[label], cell=cell) for label in labels]
+    tile_height, tile_width = tiles[0].shape
+    label_height = 14
+
+    sheet_rows = -(-len(tiles) // sheet_columns)
+    sheet = Image.new("L", (sheet_columns * (tile_width + 4), sheet_rows * (tile_height + label_height + 4)), 0)
+    draw = ImageDraw.Draw(sheet)
+    for i, (label, tile) in enumerate(zip(labels, tiles)):
+        left = (i % sheet_columns) * (tile_width + 4) + 2
+        top = (i // sheet_columns) * (tile_height + label_height + 4) + 2
+        draw.text((left, top), label, fill=200)
+        sheet.paste(Image.fromarray(tile), (left, top + label_height))
+    sheet.save(filename)
+    return filename
+
+
+# Render a contact sheet for every cave folder or cave.bin in paths into out_dir
+def render_previews(paths, out_dir="previews", cell=48):
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for path in paths:
+        if os.path.isdir(path) and not any(name.endswith("_output.txt") for name in os.listdir(path)):
+            written += render_previews(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                              if os.path.isdir(os.path.join(path, name))), out_dir, cell)
+            continue
+        views = read_views(path)
+        if not views:
+            continue
+        name = os.path.basename(os.path.normpath(path))
+        if name.endswith(".bin"):
+            name = f"{os.path.basename(os.path.dirname(os.path.abspath(path)))}_{name[:-len('.bin')]}"
+        written.append(render_contact_sheet(views, os.path.join(out_dir, f"{name}.png"), cell=cell))
+    return written
+
+
+### COMMAND LINE ###
+MODULE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+COMPARE_MESHES = ["test.obj", "testtube.obj"]  # Meshes the containment backends are compared on by default
+
+
+# Labels of every view scan_obj writes, one {label}_output.txt file each
+def get_view_labels():
+    return ["full_obj"] + list(get_quadrants(center=(0, 0, 0), max_range=0))
+
+
+# A cave is current when its catalog entry was converted with the same parameters and every file the
+# conversion writes (views, cave.bin with binary, .dlt files with delta) exists and is newer than its OBJ file
+def is_conversion_current(obj_file, output_dir, catalog_entry, parameters, binary=False, delta=False):
+    if catalog_entry is None or catalog_entry["parameters"] != parameters:
+        return False
+    output_files = [f"{label}_output.txt" for label in get_view_labels()]
+    if binary:
+        output_files.append("cave.bin")
+    if delta:
+        output_files.extend(f"{label}_output.dlt" for label in get_view_labels())
+
+    source_time = os.path.getmtime(obj_file)
+    for name in output_files:
+        output_file = os.path.join(output_dir, name)
+        if not os.path.exists(output_file) or os.path.getmtime(output_file) < source_time:
+            return False
+    return True
+
+
+# OBJ files named directly or found in the given directories, in a stable order
+def find_obj_files(paths):
+    obj_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            obj_files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                    if name.lower().endswith(".obj")))
+        else:
+            obj_files.append(path)
+    return obj_files
+
+
+def _convert_file(obj_file, output_dir, backend, voxel_resolution, cache_dir, binary, grid_size, num_rotations, delta,
+                  simplify, report_options):
+    start = time.perf_counter()
+    report = None
+    if report_options is not None:
+        report = new_scan_report(trace_memory=report_options.get("trace_memory", False),
+                                 profile_stages=report_options.get("profile_stages", ()),
+                                 profile_folder=os.path.join(report_options.get("profile_folder", "profiles"),
+                                                             os.path.basename(output_dir)))
+    scan_obj(obj_file, backend=backend, voxel_resolution=voxel_resolution, output_dir=output_dir, cache_dir=cache_dir,
+             grid_size=grid_size, num_rotations=num_rotations, simplify=simplify, report=report)
+    if binary:
+        convert_text_to_binary(output_dir, num_rotations=num_rotations)
+    if delta:
+        compress_views(output_dir)
+    return time.perf_counter() - start, report
+
+
+# Scan settings of a conversion as recorded in the catalog
+def get_scan_parameters(backend="ray", voxel_resolution=128, grid_size=16, num_rotations=55, simplify=False):
+    return {"backend": backend, "voxel_resolution": voxel_resolution if backend == "voxel" else None,
+            "grid_size": grid_size, "num_rotations": num_rotations, "simplify": simplify}
+
+
+# Convert many caves, each into its own folder under out_dir, spreading files over jobs processes,
+# and add them to the catalog of out_dir. Returns {obj_file: (status, seconds or error message)} with
+# status "converted", "skipped" or "failed". With report_options (the arguments of new_scan_report)
+# every conversion is instrumented and its report is stored in reports[obj_file]
+def convert_caves(paths, out_dir="output_folder", jobs=1, backend="ray", voxel_resolution=128, force=False,
+                  cache_dir=CACHE_FOLDER, binary=False, grid_size=16, num_rotations=55, delta=False, simplify=False,
+                  report_options=None, reports=None):
+    results = {}
+    pending = {}
+    parameters = get_scan_parameters(backend, voxel_resolution, grid_size, num_rotations, simplify)
+    caves = read_catalog(out_dir)["caves"] if not force else {}
+    for obj_file in find_obj_files(paths):
+        cave_name = os.path.splitext(os.path.basename(obj_file))[0]
+        cave_dir = os.path.join(out_dir, cave_name)
+        if not force and is_conversion_current(obj_file, cave_dir, caves.get(cave_name), parameters, binary, delta):
+            results[obj_file] = ("skipped", 0.0)
+            print(f"{obj_file}: up to date, skipped")
+        else:
+            pending[obj_file] = cave_dir
+
+    with ProcessPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = {obj_file: executor.submit(_convert_file, obj_file, cave_dir, backend, voxel_resolution, cache_dir, binary,
+                                            grid_size, num_rotations, delta, simplify, report_options)
+                   for obj_file, cave_dir in pending.items()}
+        for obj_file, future in futures.items():
+            try:
+                elapsed, report = future.result()
+            except Exception as e:
+                results[obj_file] = ("failed", str(e))
+                print(f"{obj_file}: FAILED ({e})")
+            else:
+                results[obj_file] = ("converted", elapsed)
+                print(f"{obj_file}: converted in {elapsed:.2f}s -> {pending[obj_file]}")
+                add_to_catalog(out_dir, os.path.basename(pending[obj_file]), obj_file, parameters)
+                if report is not None and reports is not None:
+                    reports[obj_file] = report
+    return results
+
+
+# argparse type for --keyframe-interval, the same range encode_delta_frames accepts
+def keyframe_interval_arg(value):
+    interval = int(value)
+    if not 1 <= interval <= 0xFFFF:
+        raise argparse.ArgumentTypeError(f"must be between 1 and 65535, got {interval}")
+    return interval
+
+
+# argparse type for --grid-size, the even sizes get_polar_index can lay out
+def grid_size_arg(value):
+    grid_size = int(value)
+    if grid_size < 2 or grid_size % 2:
+        raise argparse.ArgumentTypeError(f"must be an even number of at least 2, got {grid_size}")
+    return grid_size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m PreprocessingV2",
+                                     description="Convert cave OBJ files into LED view files without the GUI.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="convert OBJ files or directories of OBJ files")
+    convert_parser.add_argument("paths", nargs="+", help="OBJ files or directories containing them")
+    convert_parser.add_argument("--out", default="output_folder", help="folder that gets one sub folder per cave")
+    convert_parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="number of caves converted at once")
+    convert_parser.add_argument("--backend", default="ray", choices=sorted(CONTAINMENT_BACKENDS))
+    convert_parser.add_argument("--voxel-resolution", type=int, default=128)
+    convert_parser.add_argument("--grid-size", type=grid_size_arg, default=16, help="LEDs across a row and number of rows")
+    convert_parser.add_argument("--rotations", type=int, default=55, help="number of angular slices")
+    convert_parser.add_argument("--force", action="store_true", help="convert caves whose outputs are already current")
+    convert_parser.add_argument("--cache-dir", default=CACHE_FOLDER, help="folder of cached conversions")
+    convert_parser.add_argument("--no-cache", action="store_true", help="always rescan instead of using the cache")
+    convert_parser.add_argument("--binary", action="store_true", help="also write all views into one cave.bin per cave")
+    convert_parser.add_argument("--delta", action="store_true", help="also write a delta compressed .dlt file per view")
+    convert_parser.add_argument("--simplify", action="store_true", help="scan a reduced copy of large meshes")
+    convert_parser.add_argument("--report", help="time every stage and view and write the reports to this JSON file")
+    convert_parser.add_argument("--trace-memory", action="store_true", help="also measure the peak memory of every stage")
+    convert_parser.add_argument("--profile", action="append", default=[], metavar="STAGE",
+                                help="run a stage (load, grid, containment_setup, contains, encode, write) under "
+                                     "cProfile and dump the stats to profiles/<cave>/")
+
+    compare_parser = subparsers.add_parser("compare", help="report how far a containment backend disagrees with ray casting")
+    compare_parser.add_argument("obj_files", nargs="*", default=[os.path.join(MODULE_FOLDER, name) for name in COMPARE_MESHES],
+                                help="OBJ files to compare on, test.obj and testtube.obj by default")
+    compare_parser.add_argument("--backend", default="voxel", choices=sorted(CONTAINMENT_BACKENDS))
+    compare_parser.add_argument("--voxel-resolution", type=int, default=128)
+    compare_parser.add_argument("--grid-size", type=grid_size_arg, default=16)
+    compare_parser.add_argument("--rotations", type=int, default=55)
+
+    simplify_parser = subparsers.add_parser("simplify", help="build the reduced mesh of a cave and report the points it changes")
+    simplify_parser.add_argument("obj_file", help="OBJ file of the cave")
+    simplify_parser.add_argument("--backend", default="ray", choices=sorted(CONTAINMENT_BACKENDS))
+    simplify_parser.add_argument("--voxel-resolution", type=int, default=128)
+    simplify_parser.add_argument("--grid-size", type=grid_size_arg, default=16)
+    simplify_parser.add_argument("--rotations", type=int, default=55)
+    simplify_parser.add_argument("--oversample", type=int, default=SIMPLIFY_OVERSAMPLE,
+                                 help="mesh detail kept per sample spacing of the finest view")
+
+    compress_parser = subparsers.add_parser("compress", help="delta compress every view in a folder and report the ratios")
+    compress_parser.add_argument("folder", help="folder of {label}_output.txt files")
+    compress_parser.add_argument("--keyframe-interval", type=keyframe_interval_arg, default=16,
+                                 help="frames between keyframes, 1 stores every frame whole")
+
+    zoom_parser = subparsers.add_parser("zoom", help="generate the views at the given zoom paths of one cave")
+    zoom_parser.add_argument("obj_file", help="OBJ file of the cave")
+    zoom_parser.add_argument("paths", nargs="*", help="zoom paths such as Middle-Center-Middle/Top-Left-Near")
+    zoom_parser.add_argument("--out", default="output_folder", help="folder to write the views to")
+    zoom_parser.add_argument("--backend", default="ray", choices=sorted(CONTAINMENT_BACKENDS))
+    zoom_parser.add_argument("--voxel-resolution", type=int, default=128)
+    zoom_parser.add_argument("--grid-size", type=grid_size_arg, default=16, help="LEDs across a row and number of rows")
+    zoom_parser.add_argument("--rotations", type=int, default=55, help="number of angular slices")
+
+    pack_parser = subparsers.add_parser("pack", help="pack a folder of text view files into one binary cave file")
+    pack_parser.add_argument("folder", help="folder of {label}_output.txt files")
+    pack_parser.add_argument("--out", help="binary file to write, cave.bin in the folder by default")
+    pack_parser.add_argument("--rotations", type=int, default=55, help="number of angular slices the views were scanned with")
+
+    sync_parser = subparsers.add_parser("sync", help="copy changed files of a folder and its cave folders to the SD card")
+    sync_parser.add_argument("folder", help="folder of converted files, such as cave_data")
+    sync_parser.add_argument("card", help="folder on the SD card")
+    sync_parser.add_argument("--bundle", action="store_true", help="pack the view files of every cave into one <cave>.bin on the card")
+    sync_parser.add_argument("--keep-stale", action="store_true", help="keep files on the card whose source is gone from folder")
+    sync_parser.add_argument("--rotations", type=int, default=55, help="number of angular slices the views were scanned with")
+
+    validate_parser = subparsers.add_parser("validate", help="check the structure of converted views")
+    validate_parser.add_argument("paths", nargs="+", help="cave folders, libraries of them, view files or cave.bin files")
+    validate_parser.add_argument("--grid-size", type=grid_size_arg, default=16)
+    validate_parser.add_argument("--rotations", type=int, default=55)
+
+    preview_parser = subparsers.add_parser("preview", help="render a PNG contact sheet of every view of each cave")
+    preview_parser.add_argument("paths", nargs="+", help="cave folders, libraries of them or cave.bin files")
+    preview_parser.add_argument("--out", default="previews", help="folder to write the PNG files to")
+    preview_parser.add_argument("--cell", type=int, default=48, help="pixel size of one height slice")
+
+    args = parser.parse_args(argv)
+    if args.command == "convert":
+        start = time.perf_counter()
+        reports = {}
+        report_options = None
+        if args.report or args.trace_memory or args.profile:
+            report_options = {"trace_memory": args.trace_memory, "profile_stages": args.profile}
+        results = convert_caves(args.paths, out_dir=args.out, jobs=args.jobs, backend=args.backend,
+                                voxel_resolution=args.voxel_resolution, force=args.force,
+                                cache_dir=None if args.no_cache else args.cache_dir, binary=args.binary,
+                                grid_size=args.grid_size, num_rotations=args.rotations, delta=args.delta,
+                                simplify=args.simplify, report_options=report_options, reports=reports)
+        for obj_file, report in reports.items():
+            print(f"{obj_file}:\n{format_scan_report(report)}")
+        if args.report:
+            write_file_atomic(args.report, json.dumps(reports, indent=1))
+        statuses = [status for status, _ in results.values()]
+        print(f"{statuses.count('converted')} converted, {statuses.count('skipped')} skipped, "
+              f"{statuses.count('failed')} failed in {time.perf_counter() - start:.2f}s")
+        return 1 if "failed" in statuses else 0
+    if args.command == "zoom":
+        for path in args.paths:
+            try:
+                get_zoom_region((0, 0, 0), 1, path)  # Check every path before the mesh is loaded
+            except ValueError as e:
+                parser.error(str(e))
+        zoom = open_zoom_views(args.obj_file, backend=args.backend, voxel_resolution=args.voxel_resolution,
+                               grid_size=args.grid_size, num_rotations=args.rotations, output_dir=args.out)
+        for path in args.paths or [""]:
+            filename = get_zoom_view(zoom, path)
+            if filename is None:
+                filename = f"no geometry, all LEDs {'on' if zoom['pruned_inside'][path] else 'off'} (pruned)"
+            print(f"{path or 'full view'}: {filename}")
+            print(f"  children with geometry: {len(list_zoom_children(zoom, path))} of 27")
+        return 0
+    if args.command == "compare":
+        for obj_file in args.obj_files:
+            compare_containment(obj_file, backend=args.backend, voxel_resolution=args.voxel_resolution,
+                                grid_size=args.grid_size, num_rotations=args.rotations)
+        return 0
+    if args.command == "simplify":
+        compare_simplified(args.obj_file, backend=args.backend, voxel_resolution=args.voxel_resolution,
+                           grid_size=args.grid_size, num_rotations=args.rotations, oversample=args.oversample)
+        return 0
+    if args.command == "compress":
+        compress_views(args.folder, keyframe_interval=args.keyframe_interval)
+        return 0
+    if args.command == "sync":
+        files = [os.path.join(folder, name) for folder, _, names in sorted(os.walk(args.folder))
+                 for name in sorted(names) if not name.endswith(".tmp")]
+        report = sync_files(files, args.folder, args.card, bundle=args.bundle, delete_stale=not args.keep_stale,
+                            num_rotations=args.rotations)
+        print(f"{len(report['copied'])} copied, {len(report['skipped'])} unchanged, {len(report['deleted'])} deleted")
+        return 0
+    if args.command == "validate":
+        start = time.perf_counter()
+        results = validate_views(args.paths, grid_size=args.grid_size, num_rotations=args.rotations)
+        for path, problems in results.items():
+            print(f"{path}:")
+            for problem in problems:
+                print(f"  {problem}")
+        print(f"{len(results)} files with problems, checked in {time.perf_counter() - start:.2f}s")
+        return 1 if results else 0
+    if args.command == "preview":
+        for filename in render_previews(args.paths, out_dir=args.out, cell=args.cell):
+            print(filename)
+        return 0
+    if args.command == "pack":
+        print(convert_text_to_binary(args.folder, args.out, num_rotations=args.rotations))
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
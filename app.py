@@ -1,9 +1,12 @@
 from tkinter import *
-from tkinter import filedialog, messagebox, Listbox
+from tkinter import filedialog, messagebox, Listbox, ttk
 from PIL import Image, ImageTk
-from PreprocessingV2 import scan_obj
+from PreprocessingV2 import (scan_obj, sync_files, read_catalog, add_to_catalog, new_scan_report, format_scan_report,
+                             validate_views, get_scan_parameters, ScanCancelled)
 import os
+import queue
 import shutil
+import threading
 
 
 ### WIDGET FUNCTIONS ###
@@ -15,70 +18,122 @@ def list_files():
         for file in os.listdir(os.path.abspath):
             files_listbox.insert(END, file)  # Add files to the listbox
 
-# Browse renderings and process them
+# Browse renderings and queue them for conversion in the background
 def browse_renderings():
+    global next_job_id
     # Open file dialog to select files
     files = filedialog.askopenfilenames(filetypes=(("object files", "*.obj"), ("all files", "*.*")))
-    last_uploaded_file = None  # Track the last file
-
-    output_folders = []
     for file in files:
-        last_uploaded_file = os.path.basename(file)  # Get the file name
-        output_folder = scan_obj(file)  # Assuming scan_obj processes the file and returns the output folder path
-        output_folders.append(output_folder)
-
-        # Now copy the processed files to the cave_data folder
-        cave_data_folder = os.path.join(os.getcwd(), "cave_data")  # Define the cave_data folder path
-
-        # Ensure the cave_data folder exists
-        if not os.path.exists(cave_data_folder):
-            os.makedirs(cave_data_folder)
-
-        for output_folder in output_folders:
-            if os.path.exists(output_folder):  # Check if the folder exists
-                for file_name in os.listdir(output_folder):  # List all files in the folder
-                    source_file = os.path.join(output_folder, file_name)
-                    dest_file = os.path.join(cave_data_folder, file_name)
-
-                    try:
-                        # Copy the file to cave_data
-                        shutil.copy(source_file, dest_file)
-                        print(f"File {file_name} copied to {cave_data_folder}")
-                    except Exception as e:
-                        print(f"Error copying file {file_name}: {e}")
-            else:
-                print(f"Output folder does not exist: {output_folder}")
+        conversion_listbox.insert(END, f"{os.path.basename(file)}: queued")
+        job_queue.put((next_job_id, conversion_listbox.size() - 1, file))
+        next_job_id += 1
+
+
+# Cancel the conversion that is running and every one still queued
+def cancel_conversions():
+    global cancel_before
+    cancel_before = next_job_id
+
+
+# Runs on the worker thread: convert queued files one at a time and report back through
+# conversion_queue. It never touches the widgets, poll_conversions does that on the Tk thread
+def conversion_worker():
+    while True:
+        job_id, row, file = job_queue.get()
+        name = os.path.basename(file)
+        if job_id < cancel_before:
+            conversion_queue.put(("cancelled", row, name, 0, 0))
+            continue
+
+        def report_progress(views_done, view_count, label):
+            if job_id < cancel_before:
+                raise ScanCancelled(name)
+            conversion_queue.put(("progress", row, name, views_done, view_count))
+
+        try:
+            report = new_scan_report()  # Stage timings, printed once the conversion is done
+            output_folder = scan_obj(file, batched=False, progress=report_progress, report=report, **SCAN_SETTINGS)  # One view at a time so progress and cancel stay responsive
+            print(f"Converted {name}:\n{format_scan_report(report)}")
+            copy_to_cave_data(output_folder, os.path.splitext(name)[0], file, get_scan_parameters(**SCAN_SETTINGS))
+        except ScanCancelled:
+            conversion_queue.put(("cancelled", row, name, 0, 0))
+        except Exception as e:
+            print(f"Error converting {name}: {e}")
+            conversion_queue.put(("failed", row, name, 0, 0))
+        else:
+            conversion_queue.put(("done", row, name, 0, 0))
+
+
+# Copy the processed files of one conversion to its own folder in cave_data and add it to the catalog
+# with the settings it was scanned with
+def copy_to_cave_data(output_folder, cave_name, source_file, parameters):
+    cave_data_folder = os.path.join(os.getcwd(), "cave_data")  # Define the cave_data folder path
+    cave_folder = os.path.join(cave_data_folder, cave_name)
+
+    # Ensure the cave's folder exists
+    if not os.path.exists(cave_folder):
+        os.makedirs(cave_folder)
+
+    if os.path.exists(output_folder):  # Check if the folder exists
+        for file_name in os.listdir(output_folder):  # List all files in the folder
+            source_file_path = os.path.join(output_folder, file_name)
+            dest_file = os.path.join(cave_folder, file_name)
+
+            try:
+                # Copy the file to cave_data
+                shutil.copy(source_file_path, dest_file)
+                print(f"File {file_name} copied to {cave_folder}")
+            except Exception as e:
+                print(f"Error copying file {file_name}: {e}")
+        add_to_catalog(cave_data_folder, cave_name, source_file, parameters)
+    else:
+        print(f"Output folder does not exist: {output_folder}")
 
-    # Clear the Listbox and list files from cave_data folder
+
+# Clear the Listbox and list every view in the catalog of the cave_data folder
+def refresh_files_listbox():
+    global listbox_generation
+    listbox_generation += 1
     files_listbox.delete(0, END)
 
+    catalog = read_catalog(data_folder)
+    rows = [f"{cave_name}/{view}" for cave_name, entry in sorted(catalog["caves"].items()) for view in entry["views"]]
+    fill_files_listbox(rows, listbox_generation)
+
+
+# Insert rows a batch at a time between Tk events, so a large library never blocks the window.
+# A newer refresh bumps listbox_generation, which stops the fill it replaced
+def fill_files_listbox(rows, generation, start=0):
+    if generation != listbox_generation:
+        return
+    for row in rows[start:start + LISTBOX_BATCH]:
+        files_listbox.insert('end', row)  # Insert the relative file path into the listbox
+    if start + LISTBOX_BATCH < len(rows):
+        root.after(1, fill_files_listbox, rows, generation, start + LISTBOX_BATCH)
+
+
+# Apply the worker's messages to the UI, then check again shortly
+def poll_conversions():
+    try:
+        while True:
+            status, row, name, views_done, view_count = conversion_queue.get_nowait()
+            if status == "progress":
+                text = f"{name}: view {views_done}/{view_count}"
+                progress_bar.config(maximum=view_count, value=views_done)
+            else:
+                text = f"{name}: {status}"
+                progress_bar.config(value=0)
+            conversion_listbox.delete(row)
+            conversion_listbox.insert(row, text)
+
+            # Only refresh the cave list once a job has finished
+            if status == "done":
+                refresh_files_listbox()
+                current_cave_label.config(text=f"Saved Cave: {name}")
+    except queue.Empty:
+        pass
+    root.after(100, poll_conversions)
 
-    # List all files from the cave_data folder
-    if os.path.exists(cave_data_folder):  # Check if the cave_data folder exists
-        for file_name in os.listdir(cave_data_folder):
-            file_path = os.path.join(cave_data_folder, file_name)
-            relative_path = os.path.relpath(file_path, cave_data_folder)
-            files_listbox.insert('end', relative_path)  # Insert the relative file path into the listbox
-    else:
-        print("cave_data folder not found.")
-    current_cave_label.config(text=f"Saved Cave: {last_uploaded_file}")
-
-
-# Function to clear cave_data folder at start of execution
-def clear_cave_data_folder():
-    cave_data_folder = os.path.join(os.getcwd(), "cave_data")
-
-    # Check if the cave_data folder exists
-    if os.path.exists(cave_data_folder):
-        # Remove all files in the folder
-        for file_name in os.listdir(cave_data_folder):
-            file_path = os.path.join(cave_data_folder, file_name)
-            if os.path.isfile(file_path):  # Check if it's a file
-                os.remove(file_path)  # Delete the file
-            elif os.path.isdir(file_path):  # If it's a directory, delete it recursively
-                shutil.rmtree(file_path)
-    else:
-        print("cave_data folder does not exist.")
 
 # Function to browse for SD card destination
 def browse_sd_card():
@@ -94,7 +149,8 @@ def select_sd_card():
     if sd_card_path:
         messagebox.showinfo("SD Card Selected", f"SD card selected: {sd_card_path}")
 
-# Function to transfer selected files to the SD card
+# Function to sync the selected files to the SD card: only changed files are copied, files
+# left over from earlier transfers are removed and the copies are checked against their hashes
 def transfer_files():
     # Check if the SD card path is set
     if not sd_card_path:
@@ -107,14 +163,24 @@ def transfer_files():
         messagebox.showerror("Error", "No files selected.")
         return
 
-    for i in selected_files:
-        file_name = files_listbox.get(i)
-        file_path = os.path.join(data_folder, file_name)
-        # Copy the file to the SD card path
-        shutil.copy(file_path, sd_card_path)
+    file_paths = [os.path.join(data_folder, files_listbox.get(i)) for i in selected_files]
+
+    # Never put a damaged view on the card
+    problems = validate_views([path for path in file_paths if path.endswith("_output.txt")])
+    if problems:
+        details = "\n".join(f"{os.path.relpath(path, data_folder)}: {messages[0]}" for path, messages in list(problems.items())[:5])
+        messagebox.showerror("Error", f"{len(problems)} views are damaged, nothing was transferred:\n{details}")
+        return
+
+    try:
+        report = sync_files(file_paths, data_folder, sd_card_path, bundle=bundle_cave.get())
+    except Exception as e:
+        messagebox.showerror("Error", f"Transfer failed: {e}")
+        return
 
-    # Show success message if all files are copied
-    messagebox.showinfo("Success", "Files transferred successfully!")
+    # Show success message with what actually changed on the card
+    messagebox.showinfo("Success", f"Files transferred successfully!\n{len(report['copied'])} copied, "
+                                   f"{len(report['skipped'])} unchanged, {len(report['deleted'])} removed")
 
 # Select all files in the Listbox
 def select_all_files():
@@ -130,7 +196,17 @@ root.title(" ")
 root.geometry("750x600")
 current_folder = initialdir = os.path.abspath(os.getcwd())
 data_folder = os.path.join(os.path.abspath(os.getcwd()), "cave_data")
-clear_cave_data_folder()
+os.makedirs(data_folder, exist_ok=True)  # Converted caves are kept between runs and listed from cave_data/catalog.json
+LISTBOX_BATCH = 200  # Listbox rows inserted per Tk event
+SCAN_SETTINGS = {"backend": "ray", "voxel_resolution": 128, "grid_size": 16, "num_rotations": 55, "simplify": False}
+listbox_generation = 0
+
+# Background conversion: the UI queues (job id, status row, file) on job_queue and the worker
+# thread reports (status, status row, name, views done, view count) back on conversion_queue
+job_queue = queue.Queue()
+conversion_queue = queue.Queue()
+next_job_id = 0
+cancel_before = 0  # Jobs with an id below this are cancelled
 print("Current working directory:", os.getcwd())
 # Create all of the main containers
 top_frame = Frame(root, pady=3)
@@ -155,16 +231,20 @@ list_label.pack(anchor=CENTER)
 browse_button = Button(top_right_frame, text="Upload Cave", command=browse_renderings)
 browse_button.pack(side=RIGHT)
 
+cancel_button = Button(top_right_frame, text="Cancel", command=cancel_conversions)
+cancel_button.pack(side=RIGHT)
+
+progress_bar = ttk.Progressbar(top_right_frame, length=150, mode="determinate")
+progress_bar.pack(side=RIGHT, padx=3)
+
 # Create and place the UI elements for the center frame
 files_listbox = Listbox(center_frame, selectmode=MULTIPLE)
-data_files = os.listdir(data_folder)
-for name in data_files:
-    file_path = os.path.join("cave_data", name)
-    with open(file_path) as current_file:
-        cave_title = current_file.readline()
-    files_listbox.insert('end', cave_title)
 files_listbox.pack(pady=3, fill=BOTH, expand=True)
 
+# Status of every conversion started in this session
+conversion_listbox = Listbox(center_frame, height=4)
+conversion_listbox.pack(pady=3, fill=X)
+
 file_source = Image.open("./fileicon.jpg")
 photo = ImageTk.PhotoImage(file_source)
 test_button = Button(center_frame, image=photo, borderwidth=0, relief="flat").pack()
@@ -198,4 +278,12 @@ new_cave_label.pack(side=LEFT)
 transfer_button = Button(bottom_right_frame, text="Transfer to SD", command=transfer_files)
 transfer_button.pack()
 
+# Pack the selected views of every cave into one <cave>.bin on the card instead of one file per view
+bundle_cave = BooleanVar(value=False)
+bundle_check = Checkbutton(bottom_right_frame, text="Bundle cave", variable=bundle_cave)
+bundle_check.pack()
+
+threading.Thread(target=conversion_worker, daemon=True).start()
+root.after(0, refresh_files_listbox)
+root.after(100, poll_conversions)
 root.mainloop()
@@ -0,0 +1,242 @@
+import trimesh
+import numpy as np
+import PreprocessingV2 as pp
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Benchmarks for the preprocessing pipeline. Every case is a mesh and a grid size, and every stage
+# of it is timed separately (best of --repeat runs):
+#   generate_base_grid  building the rotated sampling grid
+#   contains            one containment query over the points of the full view
+#   perform_scan        one view scanned, encoded and written
+#   save_scan_output    the point based writer on the same view
+#   scan_obj            the whole conversion of the OBJ file, all 28 views, without the cache
+# plus startup/<module>: the import time of what app.py loads before its window appears.
+# Results are stored flat as {"case/stage": seconds} so two runs can be compared key by key
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+GRID_SIZES = [8, 16, 32]
+QUICK_GRID_SIZES = [8]
+STARTUP_IMPORTS = ["tkinter", "PIL.ImageTk", "PreprocessingV2"]
+STARTUP_BUDGET = 1.0  # seconds from starting Python to having everything app.py imports
+
+
+# Noisy cave like blob: an icosphere whose radius is pushed in and out by a few random waves,
+# so it stays closed but has overhangs and pockets
+def make_blob(subdivisions, seed=0):
+    rng = np.random.default_rng(seed)
+    mesh = trimesh.creation.icosphere(subdivisions=subdivisions)
+    directions = mesh.vertices / np.linalg.norm(mesh.vertices, axis=1)[:, None]
+    radius = np.ones(len(directions))
+    for _ in range(6):
+        axis = trimesh.unitize(rng.normal(size=3))
+        radius += 0.15 * np.sin(rng.uniform(2, 6) * directions @ axis + rng.uniform(0, 2 * np.pi))
+    radius += 0.02 * rng.normal(size=len(radius))
+    mesh.vertices = directions * radius[:, None]
+    return mesh
+
+
+# Open ended thick tube like testtube.obj, split into triangles no longer than the gap between
+# two sections. Long thin triangles down the whole height defeat the ray backend's culling
+def make_tube(sections):
+    tube = trimesh.creation.annulus(r_min=0.6, r_max=1.0, height=2.0, sections=sections)
+    vertices, faces = trimesh.remesh.subdivide_to_size(tube.vertices, tube.faces, max_edge=4 * np.pi / sections)
+    return trimesh.Trimesh(vertices=vertices, faces=faces)
+
+
+# (name, mesh) of every benchmark mesh, in increasing triangle count per family. The ray backend
+# costs seconds per view on a few thousand triangles, so the largest meshes stay modest
+def get_benchmark_meshes(quick=False):
+    levels = [0, 1] if quick else [0, 1, 2]
+    meshes = []
+    for level in levels:
+        sphere = trimesh.creation.icosphere(subdivisions=level + 1)
+        meshes.append((f"sphere-{len(sphere.faces)}", sphere))
+    for level in levels:
+        tube = make_tube(8 * 2 ** level)
+        meshes.append((f"tube-{len(tube.faces)}", tube))
+    for level in levels:
+        blob = make_blob(level + 1)
+        meshes.append((f"blob-{len(blob.faces)}", blob))
+    meshes.append(("test.obj", trimesh.load(os.path.join(BENCHMARK_FOLDER, "test.obj"))))
+    return meshes
+
+
+# Best wall time of repeat calls to function
+def time_stage(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# Import STARTUP_IMPORTS in a fresh interpreter under -X importtime. Returns the best of repeat runs of
+# {module: cumulative import seconds} and "total", the wall time of the whole interpreter run
+def measure_startup(repeat=3):
+    best = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {', '.join(STARTUP_IMPORTS)}"],
+                                   cwd=BENCHMARK_FOLDER, capture_output=True, text=True, check=True)
+        timings = {"total": time.perf_counter() - start}
+
+        # Lines look like "import time:  self us | cumulative us | package", nested imports indented further
+        for line in completed.stderr.splitlines():
+            fields = line[len("import time:"):].split("|")
+            if len(fields) == 3 and fields[1].strip().isdigit() and fields[2].strip() in STARTUP_IMPORTS:
+                timings[fields[2].strip()] = int(fields[1]) / 1e6
+        for name, seconds in timings.items():
+            best[name] = min(best.get(name, seconds), seconds)
+    return best
+
+
+# Time every stage for one mesh and grid size. Returns {stage: seconds}
+def benchmark_case(mesh, obj_file, grid_size, output_folder, repeat=3, num_rotations=55, backend="ray"):
+    min_val, max_val = mesh.bounds[0], mesh.bounds[1]
+    max_range = max(max_val - min_val)
+    center = (min_val + max_val) / 2.0
+    polar_index = pp.get_polar_index(grid_size=grid_size, num_rotations=num_rotations)
+
+    timings = {}
+    timings["generate_base_grid"] = time_stage(
+        lambda: pp.generate_base_grid(cube_size=grid_size, num_rotations=num_rotations, center=center,
+                                      max_range=max_range), repeat)
+
+    base_grid = pp.generate_base_grid(cube_size=grid_size, num_rotations=num_rotations, center=center,
+                                      max_range=max_range)
+    points = base_grid + center
+    contains = pp.get_containment(mesh, backend=backend)
+    timings["contains"] = time_stage(lambda: contains(points), repeat)
+    timings["perform_scan"] = time_stage(
+        lambda: pp.perform_scan(mesh, base_grid, center, label="full_obj", polar_index=polar_index,
+                                contains=contains, output_folder=output_folder), repeat)
+
+    # The point based writer takes points relative to the view location, as perform_scan passes them
+    inside_points = points[contains(points)]
+    timings["save_scan_output"] = time_stage(
+        lambda: pp.save_scan_output_to_file(points - center, inside_points - center, output_folder=output_folder,
+                                            label="full_obj"), repeat)
+
+    timings["scan_obj"] = time_stage(
+        lambda: pp.scan_obj(obj_file, backend=backend, output_dir=output_folder, cache_dir=None,
+                            grid_size=grid_size, num_rotations=num_rotations), repeat)
+    return timings
+
+
+# Run every case and return the results document
+def run_benchmarks(quick=False, repeat=3, grid_sizes=None, backend="ray"):
+    grid_sizes = grid_sizes or (QUICK_GRID_SIZES if quick else GRID_SIZES)
+    results = {}
+    for name, seconds in measure_startup(repeat).items():
+        results[f"startup/{name}"] = seconds
+        print(f"startup/{name}: {seconds * 1000:.1f} ms")
+    with tempfile.TemporaryDirectory() as folder:
+        output_folder = os.path.join(folder, "output")
+        os.makedirs(output_folder)
+        for name, mesh in get_benchmark_meshes(quick):
+            obj_file = os.path.join(folder, f"{name.replace('.', '_')}.obj")
+            mesh.export(obj_file)
+            for grid_size in grid_sizes:
+                case = f"{name}/grid{grid_size}"
+                timings = benchmark_case(mesh, obj_file, grid_size, output_folder, repeat, backend=backend)
+                for stage, seconds in timings.items():
+                    results[f"{case}/{stage}"] = seconds
+                    print(f"{case}/{stage}: {seconds * 1000:.1f} ms")
+
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "trimesh": trimesh.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+            "grid_sizes": grid_sizes,
+            "backend": backend,
+        },
+        "results": results,
+    }
+
+
+# Compare two results documents. A stage regresses when it got slower by more than threshold
+# (0.2 is 20%) and by more than min_seconds, which keeps timer noise on tiny stages out.
+# Returns the list of (key, baseline seconds, current seconds) that regressed
+def compare_benchmarks(baseline, current, threshold=0.2, min_seconds=0.005):
+    regressions = []
+    for key in sorted(baseline["results"]):
+        if key not in current["results"]:
+            continue
+        before, after = baseline["results"][key], current["results"][key]
+        change = (after - before) / before if before > 0 else 0.0
+        regressed = after - before > min_seconds and change > threshold
+        if regressed:
+            regressions.append((key, before, after))
+        print(f"{'REGRESSED ' if regressed else ''}{key}: {before * 1000:.1f} -> {after * 1000:.1f} ms ({change:+.0%})")
+
+    missing = sorted(set(baseline["results"]) - set(current["results"]))
+    if missing:
+        print(f"{len(missing)} baseline stages were not run: {', '.join(missing)}")
+    print(f"{len(regressions)} of {len(baseline['results']) - len(missing)} stages regressed past {threshold:.0%}")
+    return regressions
+
+
+def load_results(filename):
+    with open(filename) as file:
+        return json.load(file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python benchmark.py",
+                                     description="Time the stages of the preprocessing pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the results to JSON")
+    run_parser.add_argument("--out", default="benchmark_results.json", help="JSON file to write")
+    run_parser.add_argument("--quick", action="store_true", help="smaller meshes and grids")
+    run_parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best one is kept")
+    run_parser.add_argument("--grid-sizes", type=pp.grid_size_arg, nargs="+", help="grid sizes to benchmark")
+    run_parser.add_argument("--backend", default="ray", choices=sorted(pp.CONTAINMENT_BACKENDS))
+    run_parser.add_argument("--baseline", help="results to compare against once the run is done")
+    run_parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+
+    compare_parser = subparsers.add_parser("compare", help="compare results against a baseline")
+    compare_parser.add_argument("baseline", help="JSON results of the baseline")
+    compare_parser.add_argument("current", help="JSON results to check")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+
+    startup_parser = subparsers.add_parser("startup", help="measure import time, fail when over the startup budget")
+    startup_parser.add_argument("--budget", type=float, default=STARTUP_BUDGET, help="allowed seconds")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        current = run_benchmarks(quick=args.quick, repeat=args.repeat, grid_sizes=args.grid_sizes,
+                                 backend=args.backend)
+        pp.write_file_atomic(args.out, json.dumps(current, indent=1, sort_keys=True))
+        print(f"Results written to {args.out}")
+        if args.baseline:
+            return 1 if compare_benchmarks(load_results(args.baseline), current, args.threshold) else 0
+        return 0
+    if args.command == "startup":
+        timings = measure_startup()
+        for name in STARTUP_IMPORTS + ["total"]:
+            print(f"{name}: {timings.get(name, 0.0) * 1000:.1f} ms")
+        if timings["total"] > args.budget:
+            print(f"Startup takes {timings['total']:.2f}s, over the {args.budget:.2f}s budget")
+            return 1
+        return 0
+    if args.command == "compare":
+        return 1 if compare_benchmarks(load_results(args.baseline), load_results(args.current), args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())